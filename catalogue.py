@@ -0,0 +1,119 @@
+from functools import lru_cache
+import numpy as np
+from londonair import API, _as_list, get_json
+
+
+
+class SiteCatalogue:
+    """
+    Flat index of the sites of a group's daily air quality index, with one row per site and one column per species
+    so sites can be filtered with array operations instead of walking the nested LocalAuthority, Site and Species
+    structure of the response.
+
+    Attributes:
+        codes, names, site_types, authorities (np array): string arrays with the details of each site
+        species (list): codes of the species measured at any site
+        index (np array): 2D int array of shape (sites, species) of the air quality index, -1 where a species is
+                          not measured at a site
+    """
+
+    def __init__(self, codes, names, site_types, authorities, species, index):
+        self.codes = np.asarray(codes, dtype=str)
+        self.names = np.asarray(names, dtype=str)
+        self.site_types = np.asarray(site_types, dtype=str)
+        self.authorities = np.asarray(authorities, dtype=str)
+        self.species = list(species)
+        self.index = np.asarray(index, dtype=np.int64).reshape(len(self.codes), len(self.species))
+
+
+    @classmethod
+    def from_response(cls, data):
+        """
+        Builds the catalogue from a DailyAirQualityIndex response, keeping the sites in the order of the response.
+
+        Parameters:
+            data (dict): parsed json response of the Daily/MonitoringIndex endpoint
+        Returns:
+            catalogue (SiteCatalogue)
+        """
+
+        sites = []
+        species = {}
+        for authority in _as_list(data['DailyAirQualityIndex'].get('LocalAuthority')):
+            for site in _as_list(authority.get('Site')):
+                readings = {reading['@SpeciesCode']: int(reading['@AirQualityIndex'])
+                            for reading in _as_list(site.get('Species'))}
+                for code in readings:
+                    species.setdefault(code, len(species))
+                sites.append((site, authority.get('@LocalAuthorityName', ''), readings))
+
+        index = np.full((len(sites), len(species)), -1, dtype=np.int64)
+        for row, (_, _, readings) in enumerate(sites):
+            index[row, [species[code] for code in readings]] = list(readings.values())
+
+        return cls([site['@SiteCode'] for site, _, _ in sites], [site['@SiteName'] for site, _, _ in sites],
+                   [site['@SiteType'] for site, _, _ in sites], [authority for _, authority, _ in sites],
+                   species, index)
+
+
+    def __len__(self):
+        return len(self.codes)
+
+
+    def max_index(self):
+        """
+        Returns the highest air quality index of any species at each site, 0 for a site with no species.
+
+        Returns:
+            max_index (np array): int array with one value per site
+        """
+        return np.maximum(self.index.max(axis=1, initial=-1), 0)
+
+
+    def select(self, site_type=None, max_index=None):
+        """
+        Returns the positions of the sites of a type whose species are all within a maximum index.
+
+        Parameters:
+            site_type (str): type of site, e.g. 'Roadside', any type by default
+            max_index (int): highest acceptable air quality index, any index by default
+        Returns:
+            positions (np array): positions of the matching sites in the catalogue, in order
+        """
+
+        matches = np.ones(len(self), dtype=bool)
+        if site_type is not None:
+            matches &= self.site_types == site_type
+        if max_index is not None:
+            matches &= self.max_index() <= max_index
+        return np.flatnonzero(matches)
+
+
+    def recommended(self, site_type=None, max_index=None):
+        """
+        Returns the name and code of the sites of a type whose species are all within a maximum index.
+
+        Parameters:
+            site_type (str): type of site, e.g. 'Roadside', any type by default
+            max_index (int): highest acceptable air quality index, any index by default
+        Returns:
+            sites (list): list of 'name (code)' strings
+        """
+        return [f'{self.names[i]} ({self.codes[i]})' for i in self.select(site_type, max_index)]
+
+
+
+@lru_cache(maxsize=32)
+def load_catalogue(group_name, date):
+    """
+    Returns the catalogue of a group's daily air quality index for a date, built once per group and date.
+
+    Parameters:
+        group_name (str): string that corresponds to the group
+        date (str or datetime.date): date of the index
+    Returns:
+        catalogue (SiteCatalogue)
+    """
+
+    url = f'{API}/Daily/MonitoringIndex/GroupName={group_name}/Date={date}/Json'
+    return SiteCatalogue.from_response(get_json(url))
@@ -1,5 +1,139 @@
+import csv
+import glob
+import os
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from matplotlib import pyplot as mat_plot
+from matplotlib.colors import rgb_to_hsv
+
+
+# Which channels are high (1) and low (0) for each preset colour, in the order red, green, blue
+COLOUR_PRESETS = {
+    'red': (1, 0, 0),
+    'green': (0, 1, 0),
+    'blue': (0, 0, 1),
+    'cyan': (0, 1, 1),
+    'magenta': (1, 0, 1),
+    'yellow': (1, 1, 0),
+}
+
+
+
+def colour_rule(colour, upper_threshold=100, lower_threshold=50):
+    """
+    Returns the rule for a preset colour, where every high channel must be above the upper threshold and every
+    low channel below the lower threshold.
+
+    A rule is a dictionary of 'space' ('rgb' with channels from 0 to 255, or 'hsv' with channels from 0 to 1) and
+    'lower' and 'upper': tuples of the exclusive bounds of each channel, None where a channel is unbounded. A lower
+    bound above the upper bound is a range that wraps around, e.g. an HSV hue above 0.95 or below 0.05 for red.
+
+    Parameters:
+        colour (str): one of COLOUR_PRESETS
+        upper_threshold (int): integer representing the min value for the high channels
+        lower_threshold (int): integer representing the max value for the low channels
+    Returns:
+        rule (dict): colour rule for colour_mask
+    """
+
+    if colour not in COLOUR_PRESETS:
+        raise ValueError(f"Unknown colour '{colour}', choose from {', '.join(COLOUR_PRESETS)}.")
+
+    high = COLOUR_PRESETS[colour]
+    return {
+        'space': 'rgb',
+        'lower': tuple(upper_threshold if channel else None for channel in high),
+        'upper': tuple(None if channel else lower_threshold for channel in high),
+    }
+
+
+
+def read_map(map_filename):
+    """
+    Reads an image file from the data directory as an array of RGB values from 0 to 255.
+
+    Parameters:
+        map_filename (str): string containing the required filename
+    Returns:
+        map (np array): 3D float array of shape (height, width, 3)
+    """
+
+    map = mat_plot.imread(os.path.join('data', map_filename))
+
+    # PNG files are read as floats from 0 to 1, other formats as integers from 0 to 255
+    if map.dtype.kind == 'f':
+        return map[..., :3] * 255
+    return map[..., :3].astype(np.float32)
+
+
+
+def colour_mask(map, rule, hsv=None):
+    """
+    Returns a boolean mask of the pixels of an image matching a colour rule, comparing whole channels at a time.
+
+    Parameters:
+        map (np array): 3D array of RGB values from 0 to 255, of shape (height, width, 3)
+        rule (dict): colour rule, see colour_rule
+        hsv (np array): the image converted to HSV, to avoid converting it again for several HSV rules
+    Returns:
+        mask (np array): 2D boolean array, True for the pixels of the colour
+    """
+
+    if rule['space'] == 'hsv':
+        channels = rgb_to_hsv(map / 255) if hsv is None else hsv
+    else:
+        channels = map
+
+    mask = np.ones(map.shape[:2], dtype=bool)
+    for i in range(3):
+        lower, upper = rule['lower'][i], rule['upper'][i]
+
+        # A range that wraps around, such as a hue through 0
+        if lower is not None and upper is not None and lower > upper:
+            mask &= (channels[..., i] > lower) | (channels[..., i] < upper)
+            continue
+
+        if lower is not None:
+            mask &= channels[..., i] > lower
+        if upper is not None:
+            mask &= channels[..., i] < upper
+
+    return mask
+
+
+
+def classify_pixels(map, rules):
+    """
+    Classifies every pixel of an image into one of several colours in one pass. Where a pixel matches more than one
+    rule, the first rule is used.
+
+    Parameters:
+        map (np array): 3D array of RGB values from 0 to 255, of shape (height, width, 3)
+        rules (list): colour rules, see colour_rule
+    Returns:
+        classes (np array): 2D uint8 array, 0 for pixels matching no rule and i + 1 for pixels of the i-th rule
+    """
+
+    hsv = rgb_to_hsv(map / 255) if any(rule['space'] == 'hsv' for rule in rules) else None
+
+    classes = np.zeros(map.shape[:2], dtype=np.uint8)
+    for i, rule in enumerate(rules):
+        classes[(classes == 0) & colour_mask(map, rule, hsv)] = i + 1
+
+    return classes
+
+
+
+def save_mask(filename, mask):
+    """
+    Saves a binary mask as a black and white image, with the pixels in the mask in white.
+
+    Parameters:
+        filename (str): name of the output image
+        mask (np array): 2D boolean or 0/1 array
+    """
+    mat_plot.imsave(filename, mask, cmap='gray', vmin=0, vmax=1)
+
 
 
 def find_red_pixels(map_filename, upper_threshold=100, lower_threshold=50):
@@ -16,39 +150,11 @@ def find_red_pixels(map_filename, upper_threshold=100, lower_threshold=50):
         red_pixels_binary (np array): 2D numpy array representing the black and white pixels
     """
 
-    # Read and format specified file
-    map = mat_plot.imread(f'data\{map_filename}')
-    map *= 255
-
-    red_pixels = []
-    red_pixels_binary = []
-
-    for row in map:
-        row_pixels = []
-        row_pixels_binary = []
-        for pixel in row:
-            r = pixel[0]
-            g = pixel[1]
-            b = pixel[2]
-
-            # Check colour of pixel
-            if r > upper_threshold and g < lower_threshold and b < lower_threshold:
-                # If it is red, add white pixel
-                row_pixels.append([255, 255, 255])
-                row_pixels_binary.append(1)
-            else:
-                # If not red, add black pixel
-                row_pixels.append([0, 0, 0])
-                row_pixels_binary.append(0)
-        red_pixels.append(row_pixels)
-        red_pixels_binary.append(row_pixels_binary)
-    
-    red_pixels = np.array(red_pixels)
-    red_pixels_binary = np.array(red_pixels_binary)
+    mask = colour_mask(read_map(map_filename), colour_rule('red', upper_threshold, lower_threshold))
 
     # Save output image
-    mat_plot.imsave('map-red-pixels.jpg', red_pixels/255)
-    return red_pixels_binary
+    save_mask('map-red-pixels.jpg', mask)
+    return mask.astype(np.uint8)
 
 
 
@@ -66,187 +172,553 @@ def find_cyan_pixels(map_filename, upper_threshold=100, lower_threshold=50):
         cyan_pixels_binary (np array): 2D numpy array representing the black and white pixels
     """
 
-    # Read and format specified file
-    map = mat_plot.imread(f'data\{map_filename}')
-    map *= 255
-
-    cyan_pixels = []
-    cyan_pixels_binary = []
-
-    for row in map:
-        row_pixels = []
-        row_pixels_binary = []
-        for pixel in row:
-            r = pixel[0]
-            g = pixel[1]
-            b = pixel[2]
-
-            # Check colour of pixel
-            if r < lower_threshold and g > upper_threshold and b > upper_threshold:
-                # If it is cyan, add white pixel
-                row_pixels.append([255, 255, 255])
-                row_pixels_binary.append(1)
-            else:
-                # If not cyan, add black pixel
-                row_pixels.append([0, 0, 0])
-                row_pixels_binary.append(0)
-
-        cyan_pixels.append(row_pixels)
-        cyan_pixels_binary.append(row_pixels_binary)
-    
-    cyan_pixels = np.array(cyan_pixels)
-    cyan_pixels_binary = np.array(cyan_pixels_binary)
+    mask = colour_mask(read_map(map_filename), colour_rule('cyan', upper_threshold, lower_threshold))
 
     # Save output image
-    mat_plot.imsave('map-cyan-pixels.jpg', cyan_pixels/255)
-    return cyan_pixels_binary
+    save_mask('map-cyan-pixels.jpg', mask)
+    return mask.astype(np.uint8)
 
 
 
-def detect_connected_components(IMG): 
+def _runs(IMG):
     """
-    Uses the connected components algorithm, reads a binary 2D image array IMG, returns a 2D array in numpy MARK 
-    and writes the number of pixels inside each connected component region into a text file cc-output-2a.txt.
-    
+    Finds the horizontal runs of white pixels in each row of a binary image.
+
     Parameters:
         IMG (np array): 2D numpy array representing a binary black and white image
     Returns:
-        Writes connected components to file
-        MARK (np array): 2D numpy array containing either 0 (unvisited) or the component number (visited)
+        (rows, starts, ends) (tuple): row, first column and last column + 1 of each run, in raster order
+    """
+
+    # A run starts where a row steps from 0 to 1 and ends where it steps from 1 to 0
+    padded = np.pad((np.asarray(IMG) == 1).view(np.int8), ((0, 0), (1, 1)))
+    steps = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(steps == 1)
+    ends = np.nonzero(steps == -1)[1]
+    return (rows, starts, ends)
+
+
+
+def _link_runs(rows, starts, ends, width, connectivity):
+    """
+    Finds every pair of runs in consecutive rows that touch each other.
+
+    Parameters:
+        rows, starts, ends (np array): runs of the image, see _runs
+        width (int): width of the image
+        connectivity (int): 4 to only join pixels sharing an edge, 8 to also join diagonal neighbours
+    Returns:
+        (above, below) (tuple): index of the run in the upper and in the lower row of each pair
+    """
+
+    # Give every run a position in one sorted sequence, with a gap between rows so runs never touch across rows
+    stride = width + 2
+    start_keys = rows * stride + starts
+    end_keys = rows * stride + ends
+    reach = 1 if connectivity == 8 else 0
+
+    # The runs of the next row touching each run form one contiguous block of that row
+    next_row = (rows + 1) * stride
+    first = np.searchsorted(end_keys, next_row + starts - reach, side='right')
+    last = np.searchsorted(start_keys, next_row + ends + reach, side='left')
+    counts = np.maximum(last - first, 0)
+
+    above = np.repeat(np.arange(len(rows)), counts)
+    below = np.repeat(first, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return (above, below)
+
+
+
+def _merge(size, above, below):
+    """
+    Groups connected nodes of a graph with vectorised union-find: each round hooks the larger of two linked roots
+    onto the smaller one, then compresses every path to its root.
+
+    Parameters:
+        size (int): number of nodes
+        above, below (np array): the two nodes of each link
+    Returns:
+        roots (np array): root of each node, the smallest node of its group
+    """
+
+    roots = np.arange(size)
+    while True:
+        a = roots[above]
+        b = roots[below]
+        linked = a != b
+        if not linked.any():
+            return roots
+
+        np.minimum.at(roots, np.maximum(a, b)[linked], np.minimum(a, b)[linked])
+
+        # Point every node straight at its root
+        while True:
+            grand = roots[roots]
+            if np.array_equal(grand, roots):
+                break
+            roots = grand
+
+
+
+def label_components(IMG, connectivity=8):
+    """
+    Labels the connected components of white pixels in a binary image in linear time. Runs of white pixels in each
+    row are linked to the touching runs of the next row and grouped with union-find, so the work grows with the
+    number of runs rather than with the area of the components.
+
+    Parameters:
+        IMG (np array): 2D numpy array representing a binary black and white image
+        connectivity (int): 4 to only join pixels sharing an edge, 8 to also join diagonal neighbours
+    Returns:
+        (MARK, statistics) (tuple): 2D array of the smallest unsigned integer type containing 0 (black) or the 
+                                    component number, numbered from 1 in the order they are first met in the 
+                                    image, and the ComponentStatistics of the components
+    """
+
+    if connectivity not in (4, 8):
+        raise ValueError('Connectivity must be 4 or 8.')
+
+    IMG = np.asarray(IMG)
+    height, width = IMG.shape
+    rows, starts, ends = _runs(IMG)
+    roots = _merge(len(rows), *_link_runs(rows, starts, ends, width, connectivity))
+
+    # Number the components in the order of their first run, which is the order of the image
+    component_roots, run_labels = np.unique(roots, return_inverse=True)
+    total = len(component_roots)
+    MARK = np.zeros((height, width), dtype=np.min_scalar_type(total))
+
+    # Paint the pixels of each run with its label
+    lengths = ends - starts
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    MARK.flat[np.repeat(rows * width + starts, lengths) + offsets] = np.repeat(run_labels + 1, lengths)
+
+    size = np.bincount(run_labels, weights=lengths, minlength=total).astype(np.int64)
+    bbox = np.empty((total, 4), dtype=np.int64)
+    bbox[:, 0] = bbox[:, 1] = max(height, width)
+    bbox[:, 2] = bbox[:, 3] = -1
+    np.minimum.at(bbox[:, 0], run_labels, rows)
+    np.minimum.at(bbox[:, 1], run_labels, starts)
+    np.maximum.at(bbox[:, 2], run_labels, rows)
+    np.maximum.at(bbox[:, 3], run_labels, ends - 1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        centroid = np.stack([np.bincount(run_labels, weights=rows * lengths, minlength=total),
+                             np.bincount(run_labels, weights=(starts + ends - 1) * lengths / 2, minlength=total)],
+                            axis=1) / size[:, None]
+
+    return (MARK, ComponentStatistics(size, bbox, centroid))
+
+
+
+class ComponentStatistics:
     """
+    Statistics of the connected components of a labelled image, as arrays where index i is component i + 1.
+
+    Attributes:
+        size (np array): number of pixels in each component
+        bbox (np array): 2D array of the top, left, bottom and right (inclusive) of each component
+        centroid (np array): 2D array of the mean row and mean column of each component
+    """
+
+    def __init__(self, size, bbox, centroid):
+        self.size = size
+        self.bbox = bbox
+        self.centroid = centroid
+
+
+    @classmethod
+    def from_labels(cls, MARK):
+        """
+        Computes the statistics of every component of a labelled image with one pass of bincount per statistic.
+
+        Parameters:
+            MARK (np array): 2D numpy array containing either 0 (unvisited) or the component number (visited)
+        Returns:
+            statistics (ComponentStatistics)
+        """
+
+        MARK = np.asarray(MARK)
+        ys, xs = np.nonzero(MARK)
+        labels = MARK[ys, xs].astype(np.intp) - 1
+        total = int(MARK.max()) if MARK.size else 0
 
-    # Set all elements in MARK as unvisited ie 0
-    MARK = np.zeros(IMG.shape) 
+        size = np.bincount(labels, minlength=total).astype(np.int64)
+        bbox = np.empty((total, 4), dtype=np.int64)
+        bbox[:, :2] = max(MARK.shape)
+        bbox[:, 2:] = -1
+        for i, (coords, reduce) in enumerate([(ys, np.minimum), (xs, np.minimum), (ys, np.maximum), (xs, np.maximum)]):
+            reduce.at(bbox[:, i], labels, coords)
 
-    # Create an empty queue like ndarray Q to hold coordinates as a list in the form [y,x] 
-    Q = np.empty((0, 2))  
+        with np.errstate(invalid='ignore', divide='ignore'):
+            centroid = np.stack([np.bincount(labels, weights=ys, minlength=total),
+                                 np.bincount(labels, weights=xs, minlength=total)], axis=1) / size[:, None]
 
-    component_num = 1
+        return cls(size, bbox, centroid)
 
-    f = open('cc-output-2a.txt', 'w')
 
-    # Iterate through each pixel of IMG
-    for y in range(len(IMG)):
-        for x in range(len(IMG[0])):     
+    def __len__(self):
+        return len(self.size)
 
-            pixel_num = 0          
 
-            # Check if current pixel is white and unvisited
-            if IMG[y][x] == 1 and not MARK[y][x]: 
+    def ranked(self):
+        """
+        Returns the component numbers in decreasing order of size. Components of the same size stay in the order 
+        of their numbers.
 
-                # Set pixel as visited by replacing the 0 with the component num
-                MARK[y][x] = component_num  
+        Returns:
+            numbers (np array): component numbers, largest component first
+        """
+        return np.argsort(-self.size, kind='stable') + 1
 
-                # Add pixel to queue
-                Q = np.append(Q, np.array([[y, x]]), axis=0)  
-                pixel_num += 1
 
-                while len(Q) > 0:
-                    q = Q[0]
+    def top(self, k):
+        """
+        Returns the numbers of the k largest components, or of every component if there are fewer than k.
 
-                    # Remove first pixel (q) of queue
-                    Q = np.delete(Q, 0, 0)  
+        Parameters:
+            k (int): number of components
+        Returns:
+            numbers (np array): component numbers, largest component first
+        """
 
-                    # Find all the neighbours of q:
-                    neighbours = []
+        if k <= 0:
+            return np.array([], dtype=np.intp)
+        if k >= len(self):
+            return self.ranked()
 
-                    for i in range(-1, 2):
-                        for j in range(-1, 2):
-                            y_coord = q[0] + i
-                            x_coord = q[1] + j
+        # Only the k largest need to be sorted, taking the lowest numbers among components the size of the k-th
+        threshold = np.partition(self.size, len(self) - k)[len(self) - k]
+        larger = np.flatnonzero(self.size > threshold)
+        equal = np.flatnonzero(self.size == threshold)[:k-len(larger)]
+        candidates = np.concatenate([larger, equal])
+        return candidates[np.lexsort((candidates, -self.size[candidates]))] + 1
 
-                            # Check if the neighbouring pixels are within the bounds of the image
-                            if x_coord >= 0 and y_coord >= 0 and x_coord < IMG.shape[1] and y_coord < IMG.shape[0]:
-                                neighbours.append([y_coord, x_coord])
-                    
-                    for neighbour in neighbours:
-                        y_coord = int(neighbour[0])
-                        x_coord = int(neighbour[1])
-                        
-                        # Check if current pixel is white and unvisited
-                        if IMG[y_coord][x_coord] == 1 and not MARK[y_coord][x_coord]:
 
-                            # Mark pixel as visited
-                            MARK[y_coord][x_coord] = component_num  
+    def write(self, filename, numbers=None):
+        """
+        Writes the number of pixels of each component into a text file.
 
-                            # Add pixel to queue
-                            Q = np.append(Q, np.array([[y_coord, x_coord]]), axis=0)
+        Parameters:
+            filename (str): name of the output text file
+            numbers (np array): component numbers in the order to write them, in order of number by default
+        """
 
-                            # New pixel found so increment by one
-                            pixel_num += 1 
- 
-                component_num += 1
-                f.write(f'Connected Component {component_num-1}, number of pixels = {pixel_num}\n')
+        if numbers is None:
+            numbers = np.arange(1, len(self) + 1)
 
-    f.write(f'Total number of connected components = {component_num-1}')
-    f.close()
+        with open(filename, 'w') as f:
+            f.writelines(f'Connected Component {number}, number of pixels = {self.size[number-1]}\n' 
+                         for number in numbers)
+            f.write(f'Total number of connected components = {len(self)}')
+
+
+
+def top_components_mask(MARK, numbers):
+    """
+    Returns a boolean mask of the pixels belonging to any of the given components, with one lookup per pixel.
+
+    Parameters:
+        MARK (np array): 2D numpy array containing either 0 (unvisited) or the component number (visited)
+        numbers (np array): component numbers to keep
+    Returns:
+        mask (np array): 2D boolean array, True for the pixels of the components
+    """
+
+    keep = np.zeros(int(MARK.max()) + 1 if MARK.size else 1, dtype=bool)
+    keep[np.asarray(numbers, dtype=np.intp)] = True
+    return keep[MARK]
+
+
+
+def detect_connected_components(IMG, output='cc-output-2a.txt'): 
+    """
+    Uses the connected components algorithm, reads a binary 2D image array IMG, returns a 2D array in numpy MARK 
+    and writes the number of pixels inside each connected component region into a text file cc-output-2a.txt.
+    
+    Parameters:
+        IMG (np array): 2D numpy array representing a binary black and white image
+        output (str): name of the output text file, or None to not write one
+    Returns:
+        Writes connected components to file
+        MARK (np array): 2D numpy array containing either 0 (unvisited) or the component number (visited)
+    """
+
+    MARK, statistics = label_components(IMG, connectivity=8)
+
+    if output is not None:
+        statistics.write(output)
 
     return MARK
 
 
 
-def detect_connected_components_sorted(MARK):
+def detect_connected_components_sorted(MARK, statistics=None, top=2, output='cc-output-2b.txt', 
+                                       image_output='cc-top-2.jpg'):
     """
     Reads MARK and writes all connected components in decreasing order into a text file cc-output-2b.txt, and
     writes the top two largest connected components into a file named as cc-top-2.jpg.
 
     Parameters:
         MARK (np array): 2D numpy array containing either 0 (unvisited) or the component number (visited)
+        statistics (ComponentStatistics): statistics from label_components, computed from MARK if not given
+        top (int): number of largest components to keep in the image
+        output (str): name of the output text file, or None to not write one
+        image_output (str): name of the output image, or None to not save one
     Returns:
         Writes sorted components to text file
         Saves jpg image of top two components
+        numbers (np array): numbers of the largest components, largest first
     """
-    
-    lst = []
-
-    with open('cc-output-2a.txt') as f: 
-        for line in f:
-            line = line.strip().split()
-            
-            try:
-                # Add component number and pixel number to list
-                lst.append([int(line[2][:-1]), int(line[7])])
-            except:
-                pass
-    
-    # Extract total number of components from file
-    total = lst[-1][0]
-
-    # Insertion sort:
-    for i in range(1, len(lst)):
-        temp = lst[i]
-        j = i
-
-        # Move item until it is in the correct place
-        while j > 0 and lst[j-1][1] < temp[1]:
-            lst[j] = lst[j-1]
-            j -= 1
-        lst[j] = temp
-    
-    with open('cc-output-2b.txt', 'w') as f:
-        for row in lst:
-            f.write(f'Connected Component {row[0]}, number of pixels = {row[1]}\n')
-        f.write(f'Total number of connected components = {total}')
-    
 
-    top_two = []
-
-    # Iterate through each pixel in MARK
-    for y in range(len(MARK)):
-        top_two_row = []
-        for x in range(len(MARK[0])):
-
-            # Look for top two components in file
-            if MARK[y][x] == lst[0][0] or MARK[y][x] == lst[1][0]:
-                # If found, add a white pixel
-                top_two_row.append([255, 255, 255])
-            else:
-                # Otherwise, add a black pixel
-                top_two_row.append([0, 0, 0])
-        
-        top_two.append(top_two_row)
-    
-    top_two = np.array(top_two)
-    mat_plot.imsave('cc-top-2.jpg', top_two/255)
+    if statistics is None:
+        statistics = ComponentStatistics.from_labels(MARK)
+
+    if output is not None:
+        statistics.write(output, statistics.ranked())
+
+    numbers = statistics.top(top)
+    if image_output is not None:
+        save_mask(image_output, top_components_mask(MARK, numbers))
 
+    return numbers
+
+
+
+def open_map(path):
+    """
+    Opens an image for tiled processing without making any scaled copies of it. Images saved as .npy files are
+    memory-mapped, so only the tiles being processed are read from disk; other formats are decoded by matplotlib.
+
+    Parameters:
+        path (str): path of the image
+    Returns:
+        map (np array): array of shape (height, width, channels), floats from 0 to 1 or integers from 0 to 255
+    """
+
+    if path.endswith('.npy'):
+        return np.load(path, mmap_mode='r')
+    return mat_plot.imread(path)
+
+
+
+def _tiles(map, tile_rows):
+    """
+    Splits an image into bands of whole rows, converting one band at a time to RGB values from 0 to 255.
+
+    Parameters:
+        map (np array): array of shape (height, width, channels), see open_map
+        tile_rows (int): number of rows in each band
+    Returns:
+        yields (top, tile) tuples, the first row of each band and its 3D float array of RGB values
+    """
+
+    for top in range(0, map.shape[0], tile_rows):
+        tile = map[top:top+tile_rows, :, :3].astype(np.float32)
+        if map.dtype.kind == 'f':
+            tile *= 255
+        yield (top, tile)
+
+
+
+def tiled_colour_mask(map, rule, tile_rows=1024, out=None):
+    """
+    Finds the pixels of a colour in an image one band of rows at a time, so only one band is converted at once.
+
+    Parameters:
+        map (np array): array of shape (height, width, channels), see open_map
+        rule (dict): colour rule, see colour_rule
+        tile_rows (int): number of rows processed at once
+        out (str): path of a .npy file to write the mask to, memory-mapped, or None to keep it in memory
+    Returns:
+        mask (np array): 2D boolean array, True for the pixels of the colour
+    """
+
+    shape = map.shape[:2]
+    if out is None:
+        mask = np.zeros(shape, dtype=bool)
+    else:
+        mask = np.lib.format.open_memmap(out, mode='w+', dtype=bool, shape=shape)
+
+    for top, tile in _tiles(map, tile_rows):
+        mask[top:top+len(tile)] = colour_mask(tile, rule)
+
+    return mask
+
+
+
+def tiled_components(map, rule, tile_rows=1024, connectivity=8, out=None):
+    """
+    Finds the pixels of a colour and labels their connected components one band of rows at a time, so large maps 
+    can be processed in bounded memory. Each band is labelled on its own, then components touching across the 
+    border between two bands are merged, giving the same labels as label_components on the whole mask.
+
+    Parameters:
+        map (np array): array of shape (height, width, channels), see open_map
+        rule (dict): colour rule, see colour_rule
+        tile_rows (int): number of rows processed at once
+        connectivity (int): 4 to only join pixels sharing an edge, 8 to also join diagonal neighbours
+        out (str): path of a .npy file to write the labels to, memory-mapped, or None to keep them in memory
+    Returns:
+        (MARK, statistics) (tuple): 2D uint32 array containing 0 (black) or the component number, and the 
+                                    ComponentStatistics of the components
+    """
+
+    shape = map.shape[:2]
+    if out is None:
+        MARK = np.zeros(shape, dtype=np.uint32)
+    else:
+        MARK = np.lib.format.open_memmap(out, mode='w+', dtype=np.uint32, shape=shape)
+
+    # Components are first numbered per band, after the components of the bands above
+    total = 0
+    sizes, bboxes, sums, above, below = [], [], [], [], []
+    previous_row = None
+    shifts = (-1, 0, 1) if connectivity == 8 else (0,)
+
+    for top, tile in _tiles(map, tile_rows):
+        labels, statistics = label_components(colour_mask(tile, rule), connectivity)
+        labels = np.where(labels != 0, labels.astype(np.uint32) + total, 0).astype(np.uint32)
+        MARK[top:top+len(tile)] = labels
+
+        sizes.append(statistics.size)
+        bboxes.append(statistics.bbox + [top, 0, top, 0])
+        sums.append((statistics.centroid + [top, 0]) * statistics.size[:, None])
+
+        # Link the components touching across the border with the band above
+        if previous_row is not None:
+            for shift in shifts:
+                upper = previous_row[max(0, -shift):len(previous_row) - max(0, shift)]
+                lower = labels[0, max(0, shift):len(previous_row) - max(0, -shift)]
+                touching = (upper != 0) & (lower != 0)
+                above.append(upper[touching].astype(np.int64) - 1)
+                below.append(lower[touching].astype(np.int64) - 1)
+
+        previous_row = labels[-1].copy()
+        total += len(statistics)
+
+    sizes = np.concatenate(sizes) if sizes else np.zeros(0, dtype=np.int64)
+    bboxes = np.concatenate(bboxes) if bboxes else np.zeros((0, 4), dtype=np.int64)
+    sums = np.concatenate(sums) if sums else np.zeros((0, 2))
+    roots = _merge(total, np.concatenate(above) if above else np.zeros(0, np.int64),
+                   np.concatenate(below) if below else np.zeros(0, np.int64))
+
+    # Renumber the merged components in the order they are first met in the image
+    component_roots, numbers = np.unique(roots, return_inverse=True)
+    count = len(component_roots)
+    lookup = np.concatenate([[0], numbers + 1]).astype(np.uint32)
+    for top in range(0, shape[0], tile_rows):
+        MARK[top:top+tile_rows] = lookup[MARK[top:top+tile_rows]]
+
+    size = np.bincount(numbers, weights=sizes, minlength=count).astype(np.int64)
+    bbox = np.empty((count, 4), dtype=np.int64)
+    bbox[:, :2] = max(shape)
+    bbox[:, 2:] = -1
+    for i, reduce in enumerate([np.minimum, np.minimum, np.maximum, np.maximum]):
+        reduce.at(bbox[:, i], numbers, bboxes[:, i])
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        centroid = np.stack([np.bincount(numbers, weights=sums[:, 0], minlength=count),
+                             np.bincount(numbers, weights=sums[:, 1], minlength=count)], axis=1) / size[:, None]
+
+    return (MARK, ComponentStatistics(size, bbox, centroid))
+
+
+
+def _analyse_map(path, name, output_dir, colours, upper_threshold, lower_threshold, top, tile_rows):
+    """
+    Finds the pixels of each colour in one map and their connected components, writing the results of each colour
+    into its own directory under output_dir/<name>/.
+
+    Parameters:
+        path (str): path of the map
+        name (str): path of the map relative to the maps being analysed, unique among them
+        output_dir (str): directory of the results of every map
+        colours (list): preset colours to find, see COLOUR_PRESETS
+        upper_threshold (int): integer representing the min value for the high channels
+        lower_threshold (int): integer representing the max value for the low channels
+        top (int): number of largest components to keep in the image
+        tile_rows (int): number of rows processed at once
+    Returns:
+        rows (list): summary of each colour, dictionaries of 'map', 'colour', 'pixels', 'components' and 
+                     'largest_component'
+    """
+
+    map = open_map(path)
+
+    rows = []
+    for colour in colours:
+        directory = os.path.join(output_dir, name, colour)
+        os.makedirs(directory, exist_ok=True)
+
+        MARK, statistics = tiled_components(map, colour_rule(colour, upper_threshold, lower_threshold), tile_rows)
+        save_mask(os.path.join(directory, f'map-{colour}-pixels.jpg'), MARK != 0)
+        statistics.write(os.path.join(directory, 'cc-output-2a.txt'))
+        detect_connected_components_sorted(MARK, statistics, top, os.path.join(directory, 'cc-output-2b.txt'),
+                                           os.path.join(directory, f'cc-top-{top}.jpg'))
+
+        rows.append({
+            'map': name,
+            'colour': colour,
+            'pixels': int(statistics.size.sum()),
+            'components': len(statistics),
+            'largest_component': int(statistics.size.max()) if len(statistics) else 0,
+        })
+
+    return rows
+
+
+
+def analyse_maps(maps, output_dir='output', colours=('red', 'cyan'), upper_threshold=100, lower_threshold=50, 
+                 top=2, processes=None, tile_rows=1024):
+    """
+    Finds the pixels of each colour and their connected components in every map of a directory or glob pattern, 
+    spreading the maps over a pool of worker processes. The results of each map are written to 
+    output_dir/<map path>/<colour>/, where the map path is relative to the directory, or to the common directory
+    of the maps matching the pattern (e.g. 2021-01-01/map.png for 'maps/*/map.png'), so runs on different maps 
+    never overwrite each other, and a summary of every map is written to output_dir/summary.csv.
+
+    Parameters:
+        maps (str): directory of .png, .jpg and .npy maps, or a glob pattern such as 'data/maps/*.png'
+        output_dir (str): directory to write the results to
+        colours (list): preset colours to find, see COLOUR_PRESETS
+        upper_threshold (int): integer representing the min value for the high channels
+        lower_threshold (int): integer representing the max value for the low channels
+        top (int): number of largest components to keep in each image
+        processes (int): number of worker processes, or None to analyse the maps in this process
+        tile_rows (int): number of rows of a map processed at once
+    Returns:
+        summary (list): summary of each map and colour, in the order of the map paths, see _analyse_map
+    """
 
+    if os.path.isdir(maps):
+        paths = [path for extension in ['png', 'jpg', 'jpeg', 'npy'] 
+                 for path in glob.glob(os.path.join(maps, f'*.{extension}'))]
+    else:
+        paths = glob.glob(maps)
+    paths.sort()
+
+    # Maps are named by their whole path below the root, so maps of the same file name in different directories,
+    # or of the same name with different extensions, are kept apart
+    if os.path.isdir(maps):
+        root = maps
+    else:
+        root = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in paths] or ['.'])
+
+    jobs = [(path, os.path.relpath(path, root), output_dir, list(colours), upper_threshold, lower_threshold, top,
+             tile_rows) for path in paths]
+    if processes is None or processes <= 1 or len(jobs) <= 1:
+        results = [_analyse_map(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=min(processes, len(jobs))) as executor:
+            results = list(executor.map(_analyse_map, *zip(*jobs)))
+
+    summary = [row for rows in results for row in rows]
+
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, 'summary.csv'), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['map', 'colour', 'pixels', 'components', 'largest_component'])
+        writer.writeheader()
+        writer.writerows(summary)
+
+    return summary
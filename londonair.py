@@ -0,0 +1,625 @@
+import array
+import asyncio
+import codecs
+import datetime
+import hashlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+import numpy as np
+import requests
+
+
+# Root of the LondonAir AirQuality API
+API = 'https://api.erg.ic.ac.uk/AirQuality'
+
+# Seconds a response is kept before it is revalidated: data for today changes every hour, data from the last few
+# days can still be corrected, and older data only changes when it is ratified
+LIVE_TTL = 15 * 60
+RECENT_TTL = 6 * 60 * 60
+HISTORIC_TTL = 30 * 24 * 60 * 60
+
+# Number of days after which a period counts as historic
+RECENT_DAYS = 7
+
+# Status codes of failed requests that are worth retrying
+RETRY_STATUS = [429, 500, 502, 503, 504]
+
+
+
+def normalise_url(url):
+    """
+    Returns the form of a url used as its cache key, so that urls which request the same data share an entry: the
+    scheme and host are lower case, repeated and trailing slashes are removed and the query is sorted.
+
+    Parameters:
+        url (str)
+    Returns:
+        url (str): normalised url
+    """
+
+    parts = urlsplit(url.strip())
+    path = '/'.join(segment for segment in parts.path.split('/') if segment)
+    query = urlencode(sorted(parse_qsl(parts.query)))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), '/' + path, query, ''))
+
+
+
+def url_ttl(url, today=None):
+    """
+    Returns how long a response can be reused from the latest date it covers, read from the StartDate, EndDate,
+    Date or Year segments of a LondonAir url. A url with no date is treated as live data.
+
+    Parameters:
+        url (str)
+        today (datetime.date): current date, today by default
+    Returns:
+        ttl (int): number of seconds
+    """
+
+    today = datetime.date.today() if today is None else today
+    end = None
+
+    for segment in urlsplit(url).path.split('/'):
+        key, _, value = segment.partition('=')
+        try:
+            if key.lower() in ['startdate', 'enddate', 'date']:
+                date = datetime.date.fromisoformat(value[:10])
+            elif key.lower() == 'year':
+                date = datetime.date(int(value) + 1, 1, 1)
+            else:
+                continue
+        except ValueError:
+            continue
+        end = date if end is None else max(end, date)
+
+    if end is None or end >= today:
+        return LIVE_TTL
+    if end >= today - datetime.timedelta(days=RECENT_DAYS):
+        return RECENT_TTL
+    return HISTORIC_TTL
+
+
+
+class ResponseCache:
+    """
+    Cache of API responses, held in memory for the most recently used urls and on disk as one json file per url so
+    they outlive the program. Each entry stores the parsed response with the time it expires and any ETag or
+    Last-Modified header used to revalidate it.
+
+    Attributes:
+        directory (str): directory of the cached responses, None to only cache in memory
+        max_entries (int): maximum number of responses held in memory
+    """
+
+    def __init__(self, directory=None, max_entries=256):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+
+        # The cache is shared by the threads of an AsyncClient
+        self._lock = threading.Lock()
+
+
+    def _path(self, key):
+        """
+        Returns the file of a cache key in the cache directory.
+        """
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + '.json')
+
+
+    def get(self, key):
+        """
+        Returns the entry of a cache key, looking in memory before the disk, or None if it is not cached.
+
+        Parameters:
+            key (str): normalised url
+        Returns:
+            entry (dict): dictionary of 'data', 'expires', 'etag' and 'last_modified', or None
+        """
+
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+
+        if self.directory is None:
+            return None
+
+        try:
+            with open(self._path(key)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        self._remember(key, entry)
+        return entry
+
+
+    def put(self, key, entry):
+        """
+        Stores the entry of a cache key in memory and on disk. The file is written to a temporary file first, so
+        other processes never read a partly written response.
+
+        Parameters:
+            key (str): normalised url
+            entry (dict): dictionary of 'data', 'expires', 'etag' and 'last_modified'
+        """
+
+        self._remember(key, entry)
+        if self.directory is None:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        handle, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(handle, 'w') as f:
+            json.dump(entry, f)
+        os.replace(temporary, self._path(key))
+
+
+    def _remember(self, key, entry):
+        """
+        Adds an entry to the memory cache, dropping the least recently used entry when it is full.
+        """
+
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+
+    def clear(self):
+        """
+        Removes every cached response from memory and disk.
+        """
+
+        with self._lock:
+            self._memory.clear()
+        if self.directory is not None and os.path.isdir(self.directory):
+            for filename in os.listdir(self.directory):
+                if filename.endswith('.json'):
+                    os.remove(os.path.join(self.directory, filename))
+
+
+
+def _as_list(value):
+    """
+    Returns a list of the items of an API field, which holds a dictionary instead of a list when there is only one
+    item and is missing when there are none.
+    """
+
+    if value is None:
+        return []
+    return [value] if isinstance(value, dict) else value
+
+
+
+def site_species_url(site_code, species_code, start_date, end_date):
+    """
+    Returns the url of the raw data of a site and species between two dates.
+
+    Parameters:
+        site_code (str): string that corresponds to the site
+        species_code (str): string that corresponds to the pollutant
+        start_date, end_date (str or datetime.date): first date and the date after the last one
+    Returns:
+        url (str)
+    """
+    return f'{API}/Data/SiteSpecies/SiteCode={site_code}/SpeciesCode={species_code}/StartDate={start_date}/EndDate={end_date}/Json'
+
+
+
+def site_species_urls(site_codes, species_codes, date_ranges):
+    """
+    Returns the url of every combination of sites, species and date ranges, e.g. a year of data for every site.
+
+    Parameters:
+        site_codes (iterable): codes of the sites
+        species_codes (iterable): codes of the pollutants
+        date_ranges (iterable): (start_date, end_date) pairs
+    Returns:
+        urls (dict): dictionary of (site_code, species_code, start_date, end_date): url
+    """
+
+    date_ranges = list(date_ranges)
+    species_codes = list(species_codes)
+    return {(site, species, start, end): site_species_url(site, species, start, end)
+            for site in site_codes for species in species_codes for start, end in date_ranges}
+
+
+
+def date_chunks(start_date, end_date, by='month'):
+    """
+    Splits a date range into calendar months or weeks, so a long range can be fetched as several small requests.
+
+    Parameters:
+        start_date, end_date (datetime.date): first date and the date after the last one
+        by (str): size of the chunks, 'month' or 'week'
+    Returns:
+        chunks (list): list of (start_date, end_date) pairs in order, covering the range
+    """
+
+    if by not in ['month', 'week']:
+        raise ValueError(f"Unknown chunk size {by}, choose 'month' or 'week'.")
+
+    chunks = []
+    start = start_date
+    while start < end_date:
+        if by == 'week':
+            end = start + datetime.timedelta(days=7)
+        else:
+            end = datetime.date(start.year + start.month // 12, start.month % 12 + 1, 1)
+        chunks.append((start, min(end, end_date)))
+        start = end
+
+    return chunks
+
+
+
+# Shared cache of the monitoring functions, kept with the station cache
+CACHE = ResponseCache(os.path.join('data', '.cache', 'api'))
+
+
+
+def get_json(url, cache=CACHE, ttl=None, session=None):
+    """
+    Returns the parsed json response of a url, from the cache while it has not expired. An expired response is
+    revalidated with its ETag or Last-Modified date, so an unchanged response is not downloaded again, and is still
+    returned if the API cannot be reached.
+
+    Parameters:
+        url (str)
+        cache (ResponseCache): cache of responses, None to always fetch the url
+        ttl (int): seconds the response can be reused, chosen from the dates in the url by default
+        session (requests.Session): session used for the request, a new connection by default
+    Returns:
+        data (dict): parsed json response
+    """
+
+    key = normalise_url(url)
+    entry = cache.get(key) if cache is not None else None
+    if entry is not None and entry['expires'] > time.time():
+        return entry['data']
+
+    headers = {}
+    if entry is not None and entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry is not None and entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+
+    # Fall back on an expired response when the API cannot be reached, e.g. when working offline
+    try:
+        res = (session or requests).get(url, headers=headers, timeout=30)
+    except (requests.ConnectionError, requests.Timeout):
+        if entry is None:
+            raise
+        return entry['data']
+    ttl = url_ttl(url) if ttl is None else ttl
+
+    # The cached response is still current, so only its expiry changes
+    if res.status_code == 304 and entry is not None:
+        entry['expires'] = time.time() + ttl
+        cache.put(key, entry)
+        return entry['data']
+
+    res.raise_for_status()
+    data = res.json()
+
+    if cache is not None:
+        cache.put(key, {'data': data, 'expires': time.time() + ttl,
+                        'etag': res.headers.get('ETag'), 'last_modified': res.headers.get('Last-Modified')})
+    return data
+
+
+
+class AsyncClient:
+    """
+    Fetches many urls concurrently with asyncio, limiting the number of requests in flight and retrying failed
+    requests with exponential backoff. Each request runs get_json in a worker thread over one pooled session, so
+    responses are cached and revalidated as usual, or stream_raw_data for raw data that is parsed as it arrives.
+
+    Attributes:
+        concurrency (int): maximum number of requests in flight
+        retries (int): number of times a failed request is retried
+        backoff (float): seconds before the first retry, doubled for each further retry
+        cache (ResponseCache): cache of responses, None to always fetch the urls
+        session (requests.Session): session whose connections are reused by every request
+    """
+
+    def __init__(self, concurrency=8, retries=3, backoff=0.5, cache=CACHE):
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.cache = cache
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+
+    def close(self):
+        """
+        Closes the connections of the session.
+        """
+        self.session.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    async def get_json(self, url, semaphore):
+        """
+        Returns the parsed json response of a url, see _retry.
+
+        Parameters:
+            url (str)
+            semaphore (asyncio.Semaphore): limits the number of requests in flight
+        Returns:
+            data (dict): parsed json response
+        """
+        return await self._retry(semaphore, get_json, url, self.cache, None, self.session)
+
+
+    async def get_arrays(self, url, semaphore):
+        """
+        Returns the timestamps and values of a raw data url parsed as it arrives, see _retry and stream_raw_data. 
+        The response is not cached.
+
+        Parameters:
+            url (str)
+            semaphore (asyncio.Semaphore): limits the number of requests in flight
+        Returns:
+            (timestamps, values) (tuple): datetime64[m] array of the timestamps, and float64 array of the values
+        """
+        return await self._retry(semaphore, stream_raw_data, url, self.session)
+
+
+    async def _retry(self, semaphore, function, *args):
+        """
+        Runs a request in a worker thread, retrying connection errors, timeouts and the status codes in 
+        RETRY_STATUS. The semaphore is released while waiting to retry, so other requests can use it.
+
+        Parameters:
+            semaphore (asyncio.Semaphore): limits the number of requests in flight
+            function (function): function making the request, e.g. get_json
+            args: arguments of the function
+        Returns:
+            result: what the function returns
+        """
+
+        for attempt in range(self.retries + 1):
+            try:
+                async with semaphore:
+                    return await asyncio.to_thread(function, *args)
+            except requests.HTTPError as error:
+                if attempt == self.retries or error.response.status_code not in RETRY_STATUS:
+                    raise
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retries:
+                    raise
+
+            # Add jitter so failed requests do not all retry at once
+            await asyncio.sleep(self.backoff * 2 ** attempt * (0.5 + random.random()))
+
+
+    async def fetch(self, urls, return_exceptions=False, stream=False):
+        """
+        Fetches several urls concurrently and yields each response as soon as it arrives.
+
+        Parameters:
+            urls (dict or iterable): dictionary of key: url, or urls which are used as their own keys
+            return_exceptions (bool): whether to yield the exception of a request that failed after every retry
+                                      instead of raising it
+            stream (bool): whether the urls are raw data parsed into arrays as they arrive, see get_arrays
+        Yields:
+            (key, data) (tuple): key of the url and its parsed json response (or arrays), or the exception
+        """
+
+        urls = urls if isinstance(urls, dict) else {url: url for url in urls}
+        semaphore = asyncio.Semaphore(self.concurrency)
+        request = self.get_arrays if stream else self.get_json
+
+        async def fetch_one(key, url):
+            try:
+                return (key, await request(url, semaphore))
+            except Exception as error:
+                if not return_exceptions:
+                    raise
+                return (key, error)
+
+        tasks = [asyncio.ensure_future(fetch_one(key, url)) for key, url in urls.items()]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+
+def fetch_all(urls, concurrency=8, retries=3, backoff=0.5, cache=CACHE, return_exceptions=False, stream=False):
+    """
+    Fetches several urls concurrently and returns every response, e.g. the urls from site_species_urls. Raw data
+    that is kept elsewhere, such as closed months in a SnapshotStore, can be streamed into arrays instead of being
+    parsed into dictionaries and cached.
+
+    Parameters:
+        urls (dict or iterable): dictionary of key: url, or urls which are used as their own keys
+        concurrency (int): maximum number of requests in flight
+        retries (int): number of times a failed request is retried
+        backoff (float): seconds before the first retry, doubled for each further retry
+        cache (ResponseCache): cache of responses, None to always fetch the urls
+        return_exceptions (bool): whether to return the exception of a request that failed instead of raising it
+        stream (bool): whether to parse raw data urls into (timestamps, values) arrays with stream_raw_data as they
+                       arrive, without caching them
+    Returns:
+        responses (dict): dictionary of key: parsed json response (or arrays), in the order of the urls
+    """
+
+    urls = urls if isinstance(urls, dict) else {url: url for url in urls}
+
+    async def gather():
+        with AsyncClient(concurrency, retries, backoff, cache) as client:
+            return {key: data async for key, data in client.fetch(urls, return_exceptions, stream)}
+
+    responses = asyncio.run(gather())
+    return {key: responses[key] for key in urls}
+
+
+
+class RawDataParser:
+    """
+    Parses the raw data of a site and species from a response as it arrives, one record of the 'Data' list at a
+    time, into typed arrays of timestamps and values. Only the part of the response not parsed yet and the arrays
+    are held, instead of the whole response as Python dictionaries.
+
+    Attributes:
+        rows (int): number of records parsed
+        done (bool): whether the end of the 'Data' list has been reached
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.done = False
+        self._decoder = json.JSONDecoder()
+        self._text = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._in_data = False
+
+        # Timestamps as fixed width 'YYYY-MM-DD HH:MM:SS' bytes, and values with NaN for empty ones
+        self._timestamps = bytearray()
+        self._values = array.array('d')
+
+
+    def feed(self, chunk):
+        """
+        Parses every complete record in a chunk of the response, keeping an incomplete record for the next chunk.
+
+        Parameters:
+            chunk (bytes): next part of the response
+        """
+
+        if self.done:
+            return
+        self._buffer += self._text.decode(chunk)
+
+        position = 0
+        if not self._in_data:
+            start = self._buffer.find('"Data"')
+            colon = self._buffer.find(':', start + 6) if start != -1 else -1
+            opening = self._next(colon + 1) if colon != -1 else len(self._buffer)
+            if opening == len(self._buffer):
+                return
+
+            # A single record is sent as a dictionary instead of a list
+            if self._buffer[opening] == '{':
+                try:
+                    record, _ = self._decoder.raw_decode(self._buffer, opening)
+                except json.JSONDecodeError:
+                    return
+                self._add(record)
+                self._finish()
+                return
+
+            self._in_data = True
+            position = opening + 1
+
+        while True:
+            position = self._next(position)
+            if position == len(self._buffer):
+                break
+            if self._buffer[position] == ']':
+                self._finish()
+                return
+            try:
+                record, position = self._decoder.raw_decode(self._buffer, position)
+            except json.JSONDecodeError:
+                break
+            self._add(record)
+
+        self._buffer = self._buffer[position:]
+
+
+    def _next(self, position):
+        """
+        Returns the position of the next character of the buffer that is not whitespace or a comma.
+        """
+
+        while position < len(self._buffer) and self._buffer[position] in ' \t\r\n,':
+            position += 1
+        return position
+
+
+    def _add(self, record):
+        """
+        Adds the timestamp and value of a record to the arrays.
+        """
+
+        timestamp = record['@MeasurementDateGMT']
+        if len(timestamp) != 19:
+            timestamp = datetime.datetime.fromisoformat(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+        self._timestamps += timestamp.encode()
+        self._values.append(float(record['@Value']) if record['@Value'] != '' else np.nan)
+        self.rows += 1
+
+
+    def _finish(self):
+        """
+        Marks the end of the 'Data' list and releases the rest of the response.
+        """
+        self.done = True
+        self._buffer = ''
+
+
+    def arrays(self):
+        """
+        Returns the timestamps and values parsed so far.
+
+        Returns:
+            (timestamps, values) (tuple): datetime64[m] array of the timestamps, and float64 array of the values
+                                          with NaN for records with no value
+        """
+
+        timestamps = np.frombuffer(bytes(self._timestamps), dtype='S19').astype('datetime64[m]')
+        return (timestamps, np.frombuffer(self._values, dtype=np.float64).copy())
+
+
+
+def stream_raw_data(url, session=None, chunk_size=65536):
+    """
+    Returns the timestamps and values of a raw data url, parsing the response as it is downloaded so the whole
+    response is never held in memory at once.
+
+    Parameters:
+        url (str): url of the raw data of a site and species, e.g. from site_species_url
+        session (requests.Session): session used for the request, a new connection by default
+        chunk_size (int): number of bytes read at a time
+    Returns:
+        (timestamps, values) (tuple): datetime64[m] array of the timestamps, and float64 array of the values with
+                                      NaN for records with no value
+    """
+
+    parser = RawDataParser()
+    with (session or requests).get(url, stream=True, timeout=30) as res:
+        res.raise_for_status()
+        for chunk in res.iter_content(chunk_size):
+            parser.feed(chunk)
+            if parser.done:
+                break
+
+    if not parser.done:
+        raise ValueError(f'The response of {url} has no complete Data list.')
+    return parser.arrays()
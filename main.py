@@ -1,6 +1,28 @@
 from reporting import *  
 from intelligence import * 
 from monitoring import *
+from stations import StationStore
+from functools import lru_cache
+
+
+STATIONS = ['Pollution-London Harlington', 'Pollution-London Marylebone Road', 'Pollution-London N Kensington']
+
+# Parsed data files are cached here between runs
+CACHE_DIR = 'data/.cache'
+
+
+@lru_cache(maxsize=None)
+def load_reporting_data():
+    """
+    Parses the data file of each monitoring station into a StationStore, or memory-maps it from the cache if the
+    file has been parsed before. The store is only loaded on the first call, every later visit to the reporting 
+    menu reuses it.
+
+    Returns:
+        data (StationStore): pollution data for each monitoring station
+    """
+    return StationStore.from_files(STATIONS, cache_dir=CACHE_DIR)
+
 
 
 def main_menu():
@@ -34,18 +56,18 @@ def main_menu():
 
 
     
-def reporting_menu():
+def reporting_menu(data=None):
     """
     Executed when the user chooses the 'R' option in the main menu, allows the user to perform the reporting
     functions and return to the main menu.
+
+    Parameters:
+        data (StationStore): pollution data for each monitoring station, loaded once from the data files if not given
     """
    
-   # Extract data from each data file and place in a dictionary
-    data = {}
-    for filename in ['Pollution-London Harlington', 'Pollution-London Marylebone Road', 'Pollution-London N Kensington']:
-        f = open(f'data/{filename}.csv')
-        data[filename] = [line.strip().split(',') for line in f]   
-        f.close()
+    # Reuse the parsed data files
+    if data is None:
+        data = load_reporting_data()
     
     print('Monitoring stations:')
     print('H - Harlington')
@@ -63,7 +85,7 @@ def reporting_menu():
         station = 'Pollution-London N Kensington'
     else:
         print('Invalid choice, try again.\n')
-        reporting_menu()
+        reporting_menu(data)
 
     print('Pollutants:')
     print('1 - Nitric Oxide')
@@ -81,7 +103,7 @@ def reporting_menu():
         pollutant = 'pm25'
     else:
         print('Invalid choice, try again.\n')
-        reporting_menu()
+        reporting_menu(data)
 
     print('Functions:')
     print('1 - Daily average')
@@ -110,10 +132,11 @@ def reporting_menu():
         print('Missing data:', count_missing_data(data, station, pollutant))
     elif choice == '7':
         new_value = float(input('Enter a new value to fill the missing data: '))
-        print('Copy of the new data:', fill_missing_data(data, new_value, station, pollutant))
+        filled = fill_missing_data(data, new_value, station, pollutant)
+        print('Copy of the new data:', filled[station].column(pollutant).tolist())
     else:
         print('Invalid choice, try again.\n')
-        reporting_menu()
+        reporting_menu(data)
     
     main_menu()
     
@@ -126,9 +149,19 @@ def intelligence_menu():
     """
 
     print('1 - Find red pixels')
-    print('2 - Find cyan pixels\n')
+    print('2 - Find cyan pixels')
+    print('3 - Analyse every map in a directory\n')
+
+    choice = input('Choose an option: ')
+
+    if choice == '3':
+        maps = input('\nEnter a directory or pattern of map files: ')
+        output_dir = input('Enter an output directory: ')
+        processes = int(input('Enter the number of processes to use: '))
+        for row in analyse_maps(maps, output_dir, processes=processes):
+            print(f"{row['map']:<30} {row['colour']:<8} {row['components']} components, largest {row['largest_component']}")
+        main_menu()
 
-    choice = input('Find red or cyan pixels? ')
     map_filename = input('\nEnter the file name: ')
     upper_threshold = int(input('Enter an upper threshold (recommended 100): '))
     lower_threshold = int(input('Enter a lower threshold (recommended 50): '))
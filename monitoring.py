@@ -1,7 +1,9 @@
 from matplotlib import pyplot as mat_plot
 import numpy as np
-import requests
 import datetime
+from londonair import get_json
+from snapshots import SNAPSHOTS, month_means
+from catalogue import load_catalogue
 
 
 def get_live_data_from_api(site_code='MY1',species_code='NO',start_date=None,end_date=None):
@@ -59,9 +61,7 @@ def graph_past_24_hrs(site_code, species_code):
     start_time = start[11:]
 
     url = f"https://api.erg.ic.ac.uk/AirQuality/Data/SiteSpecies/SiteCode={site_code}/SpeciesCode={species_code}/StartDate={start_date}/EndDate={end_date}/Json"
-    res = requests.get(url)
-
-    data = res.json()['RawAQData']['Data']
+    data = get_json(url)['RawAQData']['Data']
     x_values = []
     y_values = []
     started = False
@@ -107,37 +107,12 @@ def yearly_data(site_code, species_code, year):
         pollution_data (dict): dictionary of month: data pairs
     """
 
-    # Format start and end of year
-    start_date = datetime.date(year, 1, 1)
-    end_date = datetime.date(year+1, 1, 2)
-
-    url = f'https://api.erg.ic.ac.uk/AirQuality/Data/SiteSpecies/SiteCode={site_code}/SpeciesCode={species_code}/StartDate={start_date}/EndDate={end_date}/Json'
-    res = requests.get(url)
-
-    data = res.json()['RawAQData']['Data']
+    # Read the year from the local snapshots, fetching only the months not stored yet
+    timestamps, values = SNAPSHOTS.load(site_code, species_code, datetime.date(year, 1, 1), datetime.date(year+1, 1, 1))
+    means = month_means(timestamps, values)
 
     x_values = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-    y_values = []
-    month = 0
-    sum = 0
-    count = 0
-
-    for i in data:
-
-        # Check row is desired month
-        if i['@MeasurementDateGMT'][5:7] == f'{month:02}':
-
-            # Check row does not contain an empty string value
-            if i['@Value'] != '':
-                sum += float(i['@Value'])
-                count += 1
-        else:
-            if count != 0:
-                # Calculate mean of values for each month
-                y_values.append(sum/count)
-            sum = 0
-            count = 0
-            month += 1
+    y_values = [means[f'{year}-{month:02}'] for month in range(1, 13) if f'{year}-{month:02}' in means]
 
     # Check there is 12 months of data
     if len(y_values) < 12:
@@ -170,11 +145,9 @@ def met_objectives(site_code, year):
     """
 
     url = f'https://api.erg.ic.ac.uk/AirQuality/Annual/MonitoringObjective/SiteCode={site_code}/Year={year}/Json'
-    res = requests.get(url)
-
     # Check there is valid data for the given site and year
     try:
-        data = res.json()['SiteObjectives']['Site']
+        data = get_json(url)['SiteObjectives']['Site']
     except:
         print('No available data for this site / year.')
         return None
@@ -214,10 +187,7 @@ def find_valid_locations(group_name):
     # Use the most recently updated data
     date = datetime.date.today() - datetime.timedelta(days=2)
 
-    url = f'https://api.erg.ic.ac.uk/AirQuality/Daily/MonitoringIndex/GroupName={group_name}/Date={date}/Json'
-
-    res = requests.get(url)
-    data = res.json()['DailyAirQualityIndex']['LocalAuthority']
+    catalogue = load_catalogue(group_name, date)
 
     age = input('Enter your age: ')
     if float(age) >= 65:
@@ -260,43 +230,7 @@ def find_valid_locations(group_name):
     elif choice == '4':
         sitetype = 'Roadside'
 
-    valid_sites = []
-
-
-
-    # I was very tired when I wrote this part
-    # Sorry
-
-    for row in data:
-        if 'Site' in row:
-            if type(row['Site']) == list:
-                for site in row['Site']:
-                    if site['@SiteType'] == sitetype:
-                        valid = True
-                        if type(site['Species']) == list:
-                            for species in site['Species']:
-                                if int(species['@AirQualityIndex']) > max_index: 
-                                    valid = False
-                        elif type(site['Species']) == dict:
-                            if int(site['Species']['@AirQualityIndex']) > max_index: 
-                                    valid = False
-                        if valid:
-                            valid_sites.append(f"{site['@SiteName']} ({site['@SiteCode']})")
-
-
-            elif type(row['Site']) == dict:
-
-                if row['Site']['@SiteType'] == sitetype:
-                    valid = True
-                    if type(row['Site']['Species']) == list:
-                        for species in row['Site']['Species']:
-                            if int(species['@AirQualityIndex']) > max_index: 
-                                valid = False
-                    elif type(row['Site']['Species']) == dict:
-                        if int(row['Site']['Species']['@AirQualityIndex']) > max_index:
-                                valid = False
-                    if valid:
-                        valid_sites.append(f"{row['Site']['@SiteName']} ({row['Site']['@SiteCode']})")
+    valid_sites = catalogue.recommended(sitetype, max_index)
 
     print('\nRecommended locations for you:')
 
@@ -2,6 +2,183 @@
 # You should modify the functions below to match
 # the signatures determined by the project specification
 
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from stations import Station, MISSING, GROUPS, read_chunks
+from sketches import QuantileSketch, merge_sketches
+
+
+# Statistics that can be requested from batch_report
+STATISTICS = ['daily_average', 'daily_median', 'hourly_average', 'monthly_average', 'peak_hour', 'count_missing_data']
+
+# Ways of filling missing values, see fill_gaps
+FILL_METHODS = ['constant', 'forward', 'linear', 'climatology']
+
+# Periods that percentile sketches can be made for, and the datetime64 unit of each
+PERIODS = {'day': 'D', 'month': 'M', 'year': 'Y'}
+
+
+
+def _station(data, monitoring_station):
+    """
+    Returns the typed Station for a monitoring station. Accepts either a StationStore or the original dictionary
+    of lists of strings read from the csv files, which is converted to a Station.
+
+    Parameters:
+        data (dict): dictionary containing the pollution data for each monitoring station
+        monitoring_station (str)
+    Returns:
+        station (Station): typed data for the monitoring station
+    """
+
+    station = data[monitoring_station]
+    if isinstance(station, Station):
+        return station
+
+    # The first row is the header, which is left in place so the data can be reused
+    return Station.from_rows(monitoring_station, station[0], station[1:])
+
+
+
+def daily_matrix(station, pollutant):
+    """
+    Arranges the values of a pollutant into a matrix with one row per day and one column per hour, from 1 to 24.
+    Missing values, and any hours absent from the data, are NaN.
+
+    Parameters:
+        station (Station)
+        pollutant (str)
+    Returns:
+        (days, matrix) (tuple): datetime64[D] array of each day, and 2D float64 array of shape (days, 24)
+    """
+
+    days, matrices = _daily_matrices(station, [station.column_index(pollutant)])
+    return (days, matrices[0])
+
+
+
+def _daily_matrices(station, indices):
+    """
+    Arranges the values of several pollutants of a station into one (days, 24) matrix each, in a single pass.
+
+    Parameters:
+        station (Station)
+        indices (list): column index of each pollutant
+    Returns:
+        (days, matrices) (tuple): datetime64[D] array of each day, and 3D float64 array of shape 
+                                  (pollutants, days, 24)
+    """
+
+    days, day_index = np.unique(station.dates, return_inverse=True)
+    matrices = np.full((len(indices), len(days), 24), np.nan)
+    matrices[:, day_index, station.hours.astype(np.intp) - 1] = station.values[indices]
+    return (days, matrices)
+
+
+
+def _sorted_quantile(ordered, counts, q):
+    """
+    Returns the q-th percentile along the last axis of an array sorted along that axis with the NaN values last, 
+    using linear interpolation between the two closest values like np.percentile.
+
+    Parameters:
+        ordered (np array): array sorted along its last axis
+        counts (np array): number of valid (non-NaN) values along the last axis
+        q (float): percentile between 0 and 100
+    Returns:
+        quantiles (np array): percentile of each row, NaN for rows without any valid value
+    """
+
+    position = np.maximum(counts - 1, 0) * (q / 100)
+    lower = np.floor(position).astype(np.intp)
+    upper = np.ceil(position).astype(np.intp)
+
+    lower_values = np.take_along_axis(ordered, lower[..., None], axis=-1)[..., 0]
+    upper_values = np.take_along_axis(ordered, upper[..., None], axis=-1)[..., 0]
+
+    quantiles = lower_values + (upper_values - lower_values) * (position - lower)
+    return np.where(counts != 0, quantiles, np.nan)
+
+
+
+def _matrix_statistics(matrix, percentiles=()):
+    """
+    Computes the mean, median, minimum, maximum, valid count and chosen percentiles along the last axis of a
+    matrix of values, ignoring NaN values. The matrix is only sorted once.
+
+    Parameters:
+        matrix (np array): float64 array, e.g. of shape (days, 24)
+        percentiles (iterable): percentiles between 0 and 100, e.g. (90, 95)
+    Returns:
+        statistics (dict): dictionary of 'mean', 'median', 'min', 'max', 'count' and 'p<q>' for each 
+                           percentile q: array of the statistic along the last axis
+    """
+
+    # Sorting puts the NaN values last, after the valid values
+    ordered = np.sort(matrix, axis=-1)
+    counts = np.count_nonzero(~np.isnan(matrix), axis=-1)
+    has_data = counts != 0
+    last = np.maximum(counts - 1, 0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.nansum(matrix, axis=-1) / counts
+
+    statistics = {
+        'mean': np.where(has_data, mean, np.nan),
+        'median': _sorted_quantile(ordered, counts, 50),
+        'min': ordered[..., 0],
+        'max': np.where(has_data, np.take_along_axis(ordered, last[..., None], axis=-1)[..., 0], np.nan),
+        'count': counts,
+    }
+    for q in percentiles:
+        statistics[f'p{q:g}'] = _sorted_quantile(ordered, counts, q)
+
+    return statistics
+
+
+
+def _peak_hours(matrix):
+    """
+    Finds the hour with the highest value along the last axis of a (days, 24) matrix, ignoring NaN values.
+
+    Parameters:
+        matrix (np array): float64 array of shape (..., 24)
+    Returns:
+        (peak_hours, peak_values) (tuple): uint8 array of the peak hour from 1 to 24 (0 if there is no data), and
+                                           float64 array of the peak value (NaN if there is no data)
+    """
+
+    has_data = ~np.isnan(matrix).all(axis=-1)
+    peak_index = np.where(np.isnan(matrix), -np.inf, matrix).argmax(axis=-1)
+    peak_values = np.take_along_axis(matrix, peak_index[..., None], axis=-1)[..., 0]
+
+    peak_hours = np.where(has_data, peak_index + 1, 0).astype(np.uint8)
+    return (peak_hours, np.where(has_data, peak_values, np.nan))
+
+
+
+def daily_statistics(data, monitoring_station, pollutant, percentiles=()):
+    """
+    Returns the mean, median, minimum, maximum, valid count and any chosen percentiles of each day for a particular
+    pollutant and monitoring station. Every statistic is computed from one sorted (days, 24) matrix, ignoring the
+    missing values.
+
+    Parameters:
+        data (dict): dictionary containing the pollution data for each monitoring station
+        monitoring_station (str)
+        pollutant (str)
+        percentiles (iterable): percentiles between 0 and 100 to compute as well, e.g. (90, 95)
+    Returns:
+        statistics (dict): dictionary of 'date', 'mean', 'median', 'min', 'max', 'count' and 'p<q>' for each 
+                           percentile q: array with one value per day, NaN for days with no data
+    """
+
+    days, matrix = daily_matrix(_station(data, monitoring_station), pollutant)
+
+    statistics = {'date': days}
+    statistics.update(_matrix_statistics(matrix, percentiles))
+    return statistics
+
 
 
 def daily_average(data, monitoring_station, pollutant):
@@ -17,27 +194,10 @@ def daily_average(data, monitoring_station, pollutant):
         daily_averages (list): list of all 365 values of the mean for each day
     """
 
-    # Extract the index of the chosen pollutant from the header of the data
-    myindex = data[monitoring_station].pop(0).index(pollutant)
-    
-    daily_averages = []
-    sum = 0
-    count = 0
-    for i in range(len(data[monitoring_station])):
-        pollution = data[monitoring_station][i][myindex]
-
-        # Skip any row containing 'no data'
-        if pollution != 'No data':
-            sum += float(pollution)
-            count += 1
-
-        # Add data to daily averages list every 24th row (each day)
-        if (i+1) % 24 == 0 and count != 0:
-            daily_averages.append(sum/count)
-            sum = 0
-            count = 0
-        
-    return daily_averages 
+    statistics = daily_statistics(data, monitoring_station, pollutant)
+
+    # Skip any day with no data
+    return statistics['mean'][statistics['count'] != 0].tolist()
 
     
 
@@ -54,40 +214,83 @@ def daily_median(data, monitoring_station, pollutant):
         daily_median (list): list of all 365 values of the median for each day
     """
 
-    # Extract the index of the chosen pollutant from the header of the data
-    myindex = data[monitoring_station].pop(0).index(pollutant)
+    statistics = daily_statistics(data, monitoring_station, pollutant)
+
+    # Skip any day with no data
+    return statistics['median'][statistics['count'] != 0].tolist()
 
-    daily_medians = []
-    hourly_data = []
-    count = 0
 
-    for i in range(len(data[monitoring_station])):
-        row = data[monitoring_station][i][myindex]
+    
+def group_statistics(data, monitoring_station, pollutant, by):
+    """
+    Returns the sum, count and mean of a particular pollutant and monitoring station for every bucket of a grouping
+    at once, e.g. every hour of the day, in a single pass over the data. Missing values are ignored.
 
-        # Skip any row containing 'no data'
-        if row != 'No data':
-            hourly_data.append(float(row))
-            count += 1
+    Parameters:
+        data (dict): dictionary containing the pollution data for each monitoring station
+        monitoring_station (str)
+        pollutant (str)
+        by (str): grouping, one of 'hour', 'weekday', 'month' or 'season'
+    Returns:
+        statistics (dict): dictionary of 'sum', 'count' and 'mean': array with one value per bucket, the mean is 
+                           NaN for buckets with no data
+    """
 
-        # Add data to daily medians list every 24th row (each day)
-        if (i+1) % 24 == 0 and len(hourly_data) != 0:
-            hourly_data.sort()
-            mid = len(hourly_data)//2
+    station = _station(data, monitoring_station)
+    statistics = _group_statistics(station, [station.column_index(pollutant)], by)
+    return {name: values[0] for name, values in statistics.items()}
 
-            # If even number of values, find the average of the two middle values
-            if len(hourly_data) % 2 == 0:
-                median = (hourly_data[mid] + hourly_data[mid-1])/2
-            else:
-                median = hourly_data[mid]
 
-            daily_medians.append(median)
-            hourly_data = []
-            count = 0
-    
-    return daily_medians
+
+def _group_statistics(station, indices, by):
+    """
+    Computes the sum, count and mean of several pollutants of a station for every bucket of a grouping, with one
+    bincount over all of the pollutants.
+
+    Parameters:
+        station (Station)
+        indices (list): column index of each pollutant
+        by (str): grouping, one of 'hour', 'weekday', 'month' or 'season'
+    Returns:
+        statistics (dict): dictionary of 'sum', 'count' and 'mean': 2D array of shape (pollutants, buckets)
+    """
+
+    sums, counts = _bucket_sums(station, indices, station.group_codes(by), GROUPS[by])
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+
+    return {'sum': sums, 'count': counts, 'mean': means}
+
+
+
+def _bucket_sums(station, indices, codes, buckets):
+    """
+    Sums and counts the valid values of several pollutants of a station in each bucket, with one bincount over all
+    of the pollutants.
+
+    Parameters:
+        station (Station)
+        indices (list): column index of each pollutant
+        codes (np array): bucket of each row, from 0 to buckets - 1
+        buckets (int): number of buckets
+    Returns:
+        (sums, counts) (tuple): 2D arrays of shape (pollutants, buckets)
+    """
+
+    values = station.values[indices]
+    valid = ~station.missing[indices]
+
+    # Give every pollutant its own range of buckets so they can be counted together
+    codes = codes + (np.arange(len(indices)) * buckets)[:, None]
+
+    shape = (len(indices), buckets)
+    sums = np.bincount(codes[valid], weights=values[valid], minlength=shape[0]*shape[1]).reshape(shape)
+    counts = np.bincount(codes[valid], minlength=shape[0]*shape[1]).reshape(shape)
+    return (sums, counts)
+
 
 
-    
 def hourly_average(data, monitoring_station, pollutant):
     """
     Returns a list with the hourly averages (i.e., 24 values) for a particular pollutant and monitoring station.
@@ -99,66 +302,94 @@ def hourly_average(data, monitoring_station, pollutant):
     Returns:
         hourly_averages (list): list of all 24 values of the average for each hour
     """
+    return group_statistics(data, monitoring_station, pollutant, 'hour')['mean'].tolist()
 
-    # Extract the index of the chosen pollutant from the header of the data
-    myindex = data[monitoring_station].pop(0).index(pollutant)
-    hourly_averages = []
+        
 
-    # Iterate through each hour of the day
-    for hour in range(1, 25):
-        sum = 0
-        count = 0
-        for row in data[monitoring_station]:
+def monthly_average(data, monitoring_station, pollutant):
+    """
+    Returns a list with the monthly averages (i.e., 12 values) for a particular pollutant and monitoring station.
 
-            # Check row matches given hour
-            if row[1][:2] == f'{hour:02}':
-                
-                # Skip any row containing 'no data'
-                if row[myindex] != 'No data':
-                    sum += float(row[myindex])
-                    count += 1
+    Parameters:
+        data (dict): dictionary containing the pollution data for each monitoring station
+        monitoring_station (str)
+        pollutant (str)
+    Returns:
+        monthly_averages (list): list of all 12 values of the average for each month
+    """
 
-        hourly_averages.append(sum/count)
+    statistics = group_statistics(data, monitoring_station, pollutant, 'month')
 
-    return hourly_averages
+    # Ensure there is data to add
+    return statistics['mean'][statistics['count'] != 0].tolist()
 
-        
 
-def monthly_average(data, monitoring_station, pollutant):
+
+def _period_bounds(dates, by):
     """
-    Returns a list with the monthly averages (i.e., 12 values) for a particular pollutant and monitoring station.
+    Returns the periods of some rows in date order and the first and last row of each, e.g. the months of a station.
+
+    Parameters:
+        dates (np array): datetime64[D] array of the date of each row, in order
+        by (str): period, one of 'day', 'month' or 'year'
+    Returns:
+        (periods, starts, ends) (tuple): datetime64 array of each period, and the first row and end of its rows
+    """
+
+    if by not in PERIODS:
+        raise ValueError(f'Unknown period {by}, choose one of {list(PERIODS)}.')
+
+    periods = dates.astype(f'datetime64[{PERIODS[by]}]')
+    if np.any(periods[1:] < periods[:-1]):
+        raise ValueError('The rows must be in date order.')
+
+    starts = np.concatenate([[0], np.flatnonzero(periods[1:] != periods[:-1]) + 1]).astype(np.intp)
+    ends = np.append(starts[1:], len(periods))
+    return (periods[starts], starts, ends)
+
+
+
+def period_sketches(data, monitoring_station, pollutant, by='month', relative_accuracy=0.01):
+    """
+    Returns a quantile sketch of a particular pollutant and monitoring station for every day, month or year with
+    data. Any percentile of a period is estimated from its sketch within the relative accuracy, and the sketches can
+    be merged, e.g. the months of a year or the same month of several stations, with sketches.merge_sketches.
 
     Parameters:
         data (dict): dictionary containing the pollution data for each monitoring station
         monitoring_station (str)
         pollutant (str)
+        by (str): period, one of 'day', 'month' or 'year'
+        relative_accuracy (float): maximum relative error of the estimated percentiles
     Returns:
-        monthly_averages (list): list of all 12 values of the average for each month
+        sketches (dict): dictionary of period (np.datetime64): QuantileSketch
     """
 
-    # Extract the index of the chosen pollutant from the header of the data
-    myindex = data[monitoring_station].pop(0).index(pollutant)
-    monthly_averages = []
+    station = _station(data, monitoring_station)
+    values = station.column(pollutant)
+    sketches = {}
 
-    # Iterate through each month of the year
-    for month in range(1, 13):
-        sum = 0
-        count = 0
-        for row in data[monitoring_station]:
+    for period, start, end in zip(*_period_bounds(station.dates, by)):
+        sketch = QuantileSketch(relative_accuracy)
+        sketch.add(values[start:end])
+        if sketch.count:
+            sketches[period] = sketch
 
-            # Check row matches given month
-            if row[0][5:7] == f'{month:02}':
-                
-                # Skip any row containing 'no data'
-                if row[myindex] != 'No data':
-                    sum += float(row[myindex])
-                    count += 1
+    return sketches
 
-        # Ensure there is data to add
-        if count != 0:
-            monthly_averages.append(sum/count)
-    
-    return monthly_averages
+
+
+def period_percentiles(sketches, percentiles=(50, 90, 95, 99)):
+    """
+    Returns the estimated percentiles of every period from their sketches.
+
+    Parameters:
+        sketches (dict): dictionary of period: QuantileSketch, e.g. from period_sketches
+        percentiles (iterable): percentiles between 0 and 100
+    Returns:
+        percentiles (dict): dictionary of period: list of the estimate of each percentile
+    """
+    return {period: [sketch.quantile(q) for q in percentiles] for period, sketch in sketches.items()}
 
 
 
@@ -172,24 +403,49 @@ def peak_hour_date(data, date, monitoring_station, pollutant):
         monitoring_station (str)
         pollutant (str)
     Returns:
-        (peak_hour, max) (tuple): tuple containing the peak hour (str) and the corresponding pollution value (float)
+        (peak_hour, max) (tuple): tuple containing the peak hour (str) and the corresponding pollution value (float),
+                                  or None if there is no data for the date
     """
 
-    # Extract the index of the chosen pollutant from the header of the data
-    myindex = data[monitoring_station].pop(0).index(pollutant)
+    station = _station(data, monitoring_station)
 
-    max = 0
-    for i in range(len(data[monitoring_station])):
-        if data[monitoring_station][i][0] == date:
-            pollution = float(data[monitoring_station][i][myindex])
-            if pollution > max:
-                max = pollution
-                index = i
-        
-        # If max has already been defined, return the result to avoid iterating through the rest of the data
-        elif max > 0:   
-            peak_hour = data[monitoring_station][index][1][:5]
-            return (peak_hour, max)
+    # Only look at the (at most 24) rows of the given date
+    rows = station.day_rows(date)
+    values = station.column(pollutant)[rows]
+    if np.isnan(values).all():
+        return None
+
+    index = np.nanargmax(values)
+    return (f'{station.hours[rows][index]:02}:00', float(values[index]))
+
+
+
+def peak_hours(data, monitoring_station, pollutant, start_date=None, end_date=None):
+    """
+    Returns the hour of the day with the highest pollution level and its value for every day in a range of dates.
+
+    Parameters:
+        data (dict): dictionary containing the pollution data for each monitoring station
+        monitoring_station (str)
+        pollutant (str)
+        start_date (str): first date in the format YYYY-MM-DD, the start of the data by default
+        end_date (str): last date in the format YYYY-MM-DD (included), the end of the data by default
+    Returns:
+        peaks (dict): dictionary of 'date', 'peak_hour' (from 1 to 24, 0 for days with no data) and 'peak_value'
+                      (NaN for days with no data): array with one value per day
+    """
+
+    days, matrix = daily_matrix(_station(data, monitoring_station), pollutant)
+
+    # Keep the days within the range
+    in_range = np.ones(len(days), dtype=bool)
+    if start_date is not None:
+        in_range &= days >= np.datetime64(start_date, 'D')
+    if end_date is not None:
+        in_range &= days <= np.datetime64(end_date, 'D')
+
+    hours, values = _peak_hours(matrix[in_range])
+    return {'date': days[in_range], 'peak_hour': hours, 'peak_value': values}
 
 
 
@@ -205,43 +461,533 @@ def count_missing_data(data, monitoring_station, pollutant):
         count (int): number of occurrences of 'No data' in the data
     """
 
-    # Extract the index of the chosen pollutant from the header of the data
-    myindex = data[monitoring_station].pop(0).index(pollutant)
-
-    count = 0
-    for row in data[monitoring_station]:
-        if row[myindex] == 'No data':
-            count += 1
-    
-    return count
+    station = _station(data, monitoring_station)
+    return int(np.count_nonzero(station.missing_mask(pollutant)))
         
 
 
-def fill_missing_data(data, new_value, monitoring_station, pollutant): 
+def fill_gaps(station, pollutant, method='constant', new_value=None):
+    """
+    Returns the values of a pollutant with the missing values filled, leaving the station's data untouched.
+
+    Methods:
+        'constant': the new value
+        'forward': the last valid value before the gap
+        'linear': linear interpolation in time between the valid values either side of the gap
+        'climatology': the mean of the valid values at the same hour of the day
+
+    Parameters:
+        station (Station)
+        pollutant (str)
+        method (str): one of FILL_METHODS
+        new_value (float): value for any gap the method cannot fill, e.g. before the first valid value when filling
+                           forward, or every gap with the 'constant' method. Such gaps are left as NaN if None
+    Returns:
+        filled (np array): 1D float64 array of the pollutant's values with the gaps filled
+    """
+
+    if method not in FILL_METHODS:
+        raise ValueError(f"Unknown fill method '{method}', choose from {', '.join(FILL_METHODS)}.")
+
+    values = station.column(pollutant)
+    missing = station.missing_mask(pollutant)
+    valid = np.flatnonzero(~missing)
+
+    if method == 'constant' or len(valid) == 0:
+        filled = values.copy()
+
+    elif method == 'forward':
+        # Index of the last valid value at or before each row, -1 before the first one
+        last_valid = np.where(missing, -1, np.arange(len(values)))
+        np.maximum.accumulate(last_valid, out=last_valid)
+        filled = np.where(last_valid >= 0, values[np.maximum(last_valid, 0)], np.nan)
+
+    elif method == 'linear':
+        times = station.timestamps.astype(np.int64)
+        filled = values.copy()
+        filled[missing] = np.interp(times[missing], times[valid], values[valid], left=np.nan, right=np.nan)
+
+    else:
+        means = _group_statistics(station, [station.column_index(pollutant)], 'hour')['mean'][0]
+        filled = np.where(missing, means[station.group_codes('hour')], values)
+
+    if new_value is not None:
+        filled[np.isnan(filled)] = new_value
+    return filled
+
+
+
+def fill_missing_data(data, new_value, monitoring_station, pollutant, method='constant', overlay=False): 
     """
     For a given monitoring station and pollutant, returns a copy of the data with the missing values
-    'No data' replaced by the value in the parameter new value.
+    'No data' replaced by the value in the parameter new value, or filled using another method of fill_gaps.
+    The original data is never modified.
 
     Parameters:
         data (dict): dictionary containing the pollution data for each monitoring station
-        new_value (float): the value to replace the 'No data' values
+        new_value (float): the value to replace the 'No data' values, or to fill any gaps the method cannot
         monitoring_station (str)
         pollutant (str)
+        method (str): one of FILL_METHODS
+        overlay (bool): if True, only the filled pollutant is returned, as a Station holding just the filled column
+                        and sharing the dates, hours and indexes of the original rather than a copy of the station
     Returns:
-        data (list): copy of the original data with missing values replaced by the new value
+        data (dict): copy of the original data with missing values replaced by the new value, or the filled 
+                     Station of only the pollutant if overlay is True
     """
 
-    # Extract the index of the chosen pollutant from the header of the data
-    myindex = data[monitoring_station].pop(0).index(pollutant)
+    station = data[monitoring_station]
+    typed = _station(data, monitoring_station)
+    myindex = typed.column_index(pollutant)
+    filled_values = fill_gaps(typed, pollutant, method, new_value)
 
-    for i in range(len(data[monitoring_station])):
+    if overlay:
+        return typed.with_values(filled_values, [pollutant])
 
-        # Check if row has a missing value
-        if data[monitoring_station][i][myindex] == 'No data':
+    if isinstance(station, Station):
+        # Replace the values of the chosen pollutant in a new Station
+        values = typed.values.copy()
+        values[myindex] = filled_values
+        filled = data.copy()
+        filled[monitoring_station] = typed.with_values(values)
+        return filled
 
-            # Replace missing value with new value
-            data[monitoring_station][i][myindex] = new_value
-    
-    return data
+    # The value column in the rows of strings, after the date and time
+    myindex += 2
+
+    # Copy the rows of the station, replacing the missing values with the filled values
+    filled = data.copy()
+    filled[monitoring_station] = [station[0]]
+    i = 0
+    for row in station[1:]:
+        # Blank lines are not part of the typed data
+        if row and row != ['']:
+            if row[myindex] == MISSING and not np.isnan(filled_values[i]):
+                row = row[:myindex] + [float(filled_values[i])] + row[myindex+1:]
+            i += 1
+        filled[monitoring_station].append(row)
+
+    return filled
+
+
+
+def batch_report(data, monitoring_stations=None, pollutants=None, statistics=STATISTICS, processes=None):
+    """
+    Computes several statistics for several pollutants and monitoring stations at once. The pollutants of each 
+    station are processed together, so the data of a station is only arranged and grouped once per report.
+
+    With more than one process, each station is reported on in a separate worker process. Stations loaded from
+    the binary cache (see Station.from_csv) are sent to the workers as the location of their memory-mapped
+    files rather than as copies of their data.
+
+    Parameters:
+        data (dict): dictionary containing the pollution data for each monitoring station
+        monitoring_stations (list): stations to report on, all the stations in data by default
+        pollutants (list): pollutants to report on, all the pollutants of each station by default
+        statistics (list): statistics to compute, any of STATISTICS
+        processes (int): number of worker processes, or None to report on every station in this process
+    Returns:
+        report (dict): dictionary of station: {'date': datetime64[D] array of each day, pollutant: {statistic: 
+                       array}}. Daily statistics have one value per day and are NaN for days with no data, 
+                       'peak_hour' gives the 'peak_hour' (0 for days with no data) and 'peak_value' of each day.
+                       Stations are in the order they were requested in.
+    """
+
+    for statistic in statistics:
+        if statistic not in STATISTICS:
+            raise ValueError(f"Unknown statistic '{statistic}', choose from {', '.join(STATISTICS)}.")
+
+    monitoring_stations = list(data if monitoring_stations is None else monitoring_stations)
+    stations = [_station(data, monitoring_station) for monitoring_station in monitoring_stations]
+    jobs = [(station, pollutants, statistics) for station in stations]
+
+    if processes is None or processes <= 1 or len(jobs) <= 1:
+        results = [_station_report(*job) for job in jobs]
+    else:
+        # map returns the results in the order of the jobs, whichever worker finishes first
+        with ProcessPoolExecutor(max_workers=min(processes, len(jobs))) as executor:
+            results = list(executor.map(_station_report, *zip(*jobs)))
+
+    return dict(zip(monitoring_stations, results))
+
+
+
+def _station_report(station, pollutants, statistics):
+    """
+    Computes the statistics of batch_report for one station.
+
+    Parameters:
+        station (Station)
+        pollutants (list): pollutants to report on, or None for all the pollutants of the station
+        statistics (list): statistics to compute, any of STATISTICS
+    Returns:
+        report (dict): dictionary of 'date': datetime64[D] array of each day, pollutant: {statistic: array}
+    """
+
+    names = station.pollutants if pollutants is None else pollutants
+    indices = [station.column_index(pollutant) for pollutant in names]
+    results = [{} for pollutant in names]
+
+    # Arrange every pollutant by day and hour once for all the daily statistics
+    if {'daily_average', 'daily_median', 'peak_hour'} & set(statistics):
+        days, matrices = _daily_matrices(station, indices)
+        daily = _matrix_statistics(matrices)
+        peak_hours, peak_values = _peak_hours(matrices)
+
+        for i, result in enumerate(results):
+            if 'daily_average' in statistics:
+                result['daily_average'] = daily['mean'][i]
+            if 'daily_median' in statistics:
+                result['daily_median'] = daily['median'][i]
+            if 'peak_hour' in statistics:
+                result['peak_hour'] = peak_hours[i]
+                result['peak_value'] = peak_values[i]
+    else:
+        days = np.unique(station.dates)
+
+    for statistic, by in [('hourly_average', 'hour'), ('monthly_average', 'month')]:
+        if statistic in statistics:
+            means = _group_statistics(station, indices, by)['mean']
+            for i, result in enumerate(results):
+                result[statistic] = means[i]
+
+    if 'count_missing_data' in statistics:
+        counts = np.count_nonzero(station.missing[indices], axis=1)
+        for i, result in enumerate(results):
+            result['count_missing_data'] = int(counts[i])
+
+    report = {'date': days}
+    report.update(zip(names, results))
+    return report
+
+
+
+class RunningStatistics:
+    """
+    Accumulates the daily, hourly and monthly sums and counts, the daily medians, a quantile sketch of each month
+    and the number of missing values of every pollutant of a monitoring station, one chunk of rows at a time. Only
+    the totals are kept, along with the rows of the latest day until its median is final, so reports can be made
+    over data that is too large to load at once or kept up to date as new rows arrive.
+
+    Attributes:
+        pollutants (list): names of the pollutants
+        relative_accuracy (float): maximum relative error of the percentiles estimated from the sketches
+        first_day (np.datetime64): first day of the data, None before any rows have been added
+        daily_sum, daily_count (np array): 2D arrays of shape (pollutants, days) from the first day
+        daily_medians (np array): 2D array of shape (pollutants, days) of the median of each completed day
+        hourly_sum, hourly_count (np array): 2D arrays of shape (pollutants, 24)
+        monthly_sum, monthly_count (np array): 2D arrays of shape (pollutants, 12)
+        missing_count (np array): number of missing values of each pollutant
+        monthly_sketches (dict): dictionary of month (np.datetime64): list of the QuantileSketch of each pollutant
+        rows (int): number of rows added
+        days (int): number of days from the first to the last day added
+    """
+
+    def __init__(self, pollutants, relative_accuracy=0.01):
+        self.pollutants = list(pollutants)
+        self.relative_accuracy = relative_accuracy
+        self.first_day = None
+        self.daily_sum = np.zeros((len(self.pollutants), 0))
+        self.daily_count = np.zeros((len(self.pollutants), 0), dtype=np.int64)
+        self.daily_medians = np.zeros((len(self.pollutants), 0))
+        self.hourly_sum = np.zeros((len(self.pollutants), 24))
+        self.hourly_count = np.zeros((len(self.pollutants), 24), dtype=np.int64)
+        self.monthly_sum = np.zeros((len(self.pollutants), 12))
+        self.monthly_count = np.zeros((len(self.pollutants), 12), dtype=np.int64)
+        self.missing_count = np.zeros(len(self.pollutants), dtype=np.int64)
+        self.monthly_sketches = {}
+        self.rows = 0
+        self.days = 0
+
+        # Day offset, hour and values of the rows of the latest day
+        self._latest = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint8), 
+                        np.zeros((len(self.pollutants), 0)))
+
+
+    def update(self, station):
+        """
+        Adds the rows of a Station, or a chunk of one, to the totals. Rows must be added in date order, starting no
+        earlier than the latest day already added.
+
+        Parameters:
+            station (Station)
+        """
+
+        if len(station) == 0:
+            return
+        indices = [station.column_index(pollutant) for pollutant in self.pollutants]
+
+        # Days are counted from the first day added
+        first_day = station.dates[0] if self.first_day is None else self.first_day
+        offsets = (station.dates - first_day).astype(np.int64)
+        latest = self.days - 1 if self.days else 0
+        if offsets[0] < latest or np.any(offsets[1:] < offsets[:-1]):
+            raise ValueError('Rows must be added in date order, from the latest day already added.')
+        self.first_day = first_day
+
+        for by, sums, counts in [('hour', self.hourly_sum, self.hourly_count),
+                                 ('month', self.monthly_sum, self.monthly_count)]:
+            statistics = _group_statistics(station, indices, by)
+            sums += statistics['sum']
+            counts += statistics['count']
+
+        self.missing_count += np.count_nonzero(station.missing[indices], axis=1)
+        self.rows += len(station)
+
+        # A month can continue from the previous chunk, so its sketches keep being added to
+        for month, start, end in zip(*_period_bounds(station.dates, 'month')):
+            if month not in self.monthly_sketches:
+                self.monthly_sketches[month] = [QuantileSketch(self.relative_accuracy) for _ in self.pollutants]
+            for sketch, values in zip(self.monthly_sketches[month], station.values[indices, start:end]):
+                sketch.add(values)
+
+        self.days = max(self.days, int(offsets[-1]) + 1)
+        if self.days > self.daily_sum.shape[1]:
+            self._grow(self.days)
+
+        sums, counts = _bucket_sums(station, indices, offsets, self.daily_sum.shape[1])
+        self.daily_sum += sums
+        self.daily_count += counts
+
+        # Every day before the last one in the rows is complete, so its median is final
+        offsets = np.concatenate([self._latest[0], offsets])
+        hours = np.concatenate([self._latest[1], station.hours])
+        values = np.concatenate([self._latest[2], station.values[indices]], axis=1)
+
+        days, medians = self._medians(offsets, hours, values)
+        self.daily_medians[:, days[:-1]] = medians[:, :-1]
+
+        is_latest = offsets == days[-1]
+        self._latest = (offsets[is_latest], hours[is_latest], values[:, is_latest])
+
+
+    def _medians(self, offsets, hours, values):
+        """
+        Computes the median of each day of some rows.
+
+        Parameters:
+            offsets (np array): day of each row, counted from the first day
+            hours (np array): hour of each row, from 1 to 24
+            values (np array): 2D array of shape (pollutants, rows)
+        Returns:
+            (days, medians) (tuple): day offsets, and 2D array of shape (pollutants, days) of their medians
+        """
+
+        days, day_index = np.unique(offsets, return_inverse=True)
+        matrices = np.full((len(self.pollutants), len(days), 24), np.nan)
+        matrices[:, day_index, hours.astype(np.intp) - 1] = values
+
+        ordered = np.sort(matrices, axis=-1)
+        return (days, _sorted_quantile(ordered, np.count_nonzero(~np.isnan(matrices), axis=-1), 50))
+
+
+    def _grow(self, days):
+        """
+        Extends the daily totals to hold at least the given number of days, doubling their size to keep the cost of
+        growing them low.
+
+        Parameters:
+            days (int): number of days needed
+        """
+
+        extra = max(days, 2 * self.daily_sum.shape[1]) - self.daily_sum.shape[1]
+        self.daily_sum = np.pad(self.daily_sum, ((0, 0), (0, extra)))
+        self.daily_count = np.pad(self.daily_count, ((0, 0), (0, extra)))
+        self.daily_medians = np.pad(self.daily_medians, ((0, 0), (0, extra)), constant_values=np.nan)
+
+
+    def dates(self):
+        """
+        Returns the date of each day from the first to the last day added.
+
+        Returns:
+            dates (np array): datetime64[D] array of each day
+        """
+
+        if self.first_day is None:
+            return np.array([], dtype='datetime64[D]')
+        return self.first_day + np.arange(self.days)
+
+
+    def _mean(self, sums, counts, pollutant):
+        """
+        Returns the mean of a pollutant in each bucket from its sums and counts, NaN for buckets with no data.
+        """
+        i = self.pollutants.index(pollutant)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return sums[i] / counts[i]
+
+
+    def daily_average(self, pollutant):
+        """
+        Returns the average of each day with data for a pollutant, like reporting.daily_average.
+
+        Parameters:
+            pollutant (str)
+        Returns:
+            daily_averages (list): list of the mean of each day
+        """
+        means = self._mean(self.daily_sum[:, :self.days], self.daily_count[:, :self.days], pollutant)
+        return means[self.daily_count[self.pollutants.index(pollutant), :self.days] != 0].tolist()
+
+
+    def daily_median(self, pollutant):
+        """
+        Returns the median of each day with data for a pollutant, like reporting.daily_median, including the latest
+        day so far.
+
+        Parameters:
+            pollutant (str)
+        Returns:
+            daily_medians (list): list of the median of each day
+        """
+
+        i = self.pollutants.index(pollutant)
+        medians = self.daily_medians[i, :self.days].copy()
+        if len(self._latest[0]):
+            days, latest = self._medians(*self._latest)
+            medians[days[0]] = latest[i, 0]
+
+        return medians[self.daily_count[i, :self.days] != 0].tolist()
+
+
+    def hourly_average(self, pollutant):
+        """
+        Returns the average of each hour of the day for a pollutant, like reporting.hourly_average.
+
+        Parameters:
+            pollutant (str)
+        Returns:
+            hourly_averages (list): list of all 24 values of the average for each hour
+        """
+        return self._mean(self.hourly_sum, self.hourly_count, pollutant).tolist()
+
+
+    def monthly_average(self, pollutant):
+        """
+        Returns the average of each month with data for a pollutant, like reporting.monthly_average.
+
+        Parameters:
+            pollutant (str)
+        Returns:
+            monthly_averages (list): list of the average for each month
+        """
+        means = self._mean(self.monthly_sum, self.monthly_count, pollutant)
+        return means[self.monthly_count[self.pollutants.index(pollutant)] != 0].tolist()
+
+
+    def sketches(self, pollutant, by='month'):
+        """
+        Returns the quantile sketch of a pollutant for every month or year with data, merging the monthly sketches
+        for years. The sketches of several stations or workers can be merged further with sketches.merge_sketches.
+
+        Parameters:
+            pollutant (str)
+            by (str): period, 'month' or 'year'
+        Returns:
+            sketches (dict): dictionary of period (np.datetime64): QuantileSketch
+        """
+
+        if by not in ['month', 'year']:
+            raise ValueError(f"Unknown period {by}, choose 'month' or 'year'.")
+        i = self.pollutants.index(pollutant)
+
+        periods = {}
+        for month in sorted(self.monthly_sketches):
+            if self.monthly_sketches[month][i].count:
+                periods.setdefault(month.astype(f'datetime64[{PERIODS[by]}]'), []).append(self.monthly_sketches[month][i])
+
+        return {period: merge_sketches(sketches) for period, sketches in periods.items()}
+
+
+    def percentiles(self, pollutant, percentiles=(50, 90, 95, 99), by='month'):
+        """
+        Returns the estimated percentiles of a pollutant for every month or year with data.
+
+        Parameters:
+            pollutant (str)
+            percentiles (iterable): percentiles between 0 and 100
+            by (str): period, 'month' or 'year'
+        Returns:
+            percentiles (dict): dictionary of period: list of the estimate of each percentile
+        """
+        return period_percentiles(self.sketches(pollutant, by), percentiles)
+
+
+    def count_missing_data(self, pollutant):
+        """
+        Returns the number of missing values for a pollutant, like reporting.count_missing_data.
+
+        Parameters:
+            pollutant (str)
+        Returns:
+            count (int): number of occurrences of 'No data' in the data
+        """
+        return int(self.missing_count[self.pollutants.index(pollutant)])
+
+
+
+class IncrementalReport:
+    """
+    Keeps the RunningStatistics of every station of a StationStore up to date as hourly rows are appended to the
+    stations' csv files. Each refresh only reads and adds the new rows.
+
+    Attributes:
+        store (StationStore): the stations, loaded with StationStore.from_files
+        statistics (dict): dictionary of station name: RunningStatistics
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.statistics = {}
+        for name, station in store.items():
+            self.statistics[name] = RunningStatistics(station.pollutants)
+            self.statistics[name].update(station)
+
+
+    def refresh(self):
+        """
+        Reads the new rows of every station's file and adds them to the store and to the running statistics. The
+        totals cannot take a row back out, so the statistics of a station whose last row was replaced (see
+        StationStore.refresh) are computed again from the store.
+
+        Returns:
+            new_rows (dict): dictionary of station name: number of new rows
+        """
+
+        lengths = {name: len(station) for name, station in self.store.items()}
+        new_rows = self.store.refresh()
+        for name, rows in new_rows.items():
+            if len(self.store[name]) == lengths[name] + len(rows):
+                self.statistics[name].update(rows)
+            else:
+                self.statistics[name] = RunningStatistics(self.store[name].pollutants,
+                                                          self.statistics[name].relative_accuracy)
+                self.statistics[name].update(self.store[name])
+
+        return {name: len(rows) for name, rows in new_rows.items()}
+
+
+
+def stream_statistics(filename, monitoring_station=None, chunk_size=100000):
+    """
+    Reads a pollution csv file in chunks and returns the running statistics of all its pollutants, holding at most
+    one chunk of rows in memory.
+
+    Parameters:
+        filename (str): path of the csv file
+        monitoring_station (str): name of the monitoring station, the file name by default
+        chunk_size (int): maximum number of rows read at once
+    Returns:
+        statistics (RunningStatistics): totals for every pollutant in the file
+    """
 
+    statistics = None
+    for chunk in read_chunks(monitoring_station or filename, filename, chunk_size):
+        if statistics is None:
+            statistics = RunningStatistics(chunk.pollutants)
+        statistics.update(chunk)
 
+    if statistics is None:
+        raise ValueError(f'There is no data in {filename}.')
+    return statistics
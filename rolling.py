@@ -0,0 +1,172 @@
+import numpy as np
+
+
+
+def _window_counts(valid, window):
+    """
+    Returns the number of True values in each window along the last axis, using a cumulative sum.
+
+    Parameters:
+        valid (np array): boolean array
+        window (int): number of values in each window
+    Returns:
+        counts (np array): integer array of the same shape, the count of the window ending at each position
+    """
+
+    cumulative = np.cumsum(valid, axis=-1, dtype=np.int64)
+    counts = cumulative.copy()
+    counts[..., window:] -= cumulative[..., :-window]
+    return counts
+
+
+
+def _check_window(window, min_valid):
+    """
+    Returns the minimum number of valid values for a window, raises an exception if the window is invalid.
+
+    Parameters:
+        window (int): number of values in each window
+        min_valid (int): minimum number of valid values, or None for the whole window
+    Returns:
+        min_valid (int): minimum number of valid values
+    """
+
+    if window < 1:
+        raise ValueError('The window must contain at least one value.')
+    return window if min_valid is None else min_valid
+
+
+
+def rolling_mean(values, window, min_valid=None):
+    """
+    Returns the mean of each window of consecutive values ending at each position, e.g. the 8-hour running mean of
+    hourly data, ignoring NaN values. Computed in O(n) from cumulative sums.
+
+    Parameters:
+        values (np array): 1D array of values, or 2D array with one series per row such as Station.values
+        window (int): number of values in each window
+        min_valid (int): minimum number of valid values for a window to have a mean, the whole window by default
+    Returns:
+        means (np array): float64 array of the same shape, NaN where a window has too few valid values
+    """
+
+    min_valid = _check_window(window, min_valid)
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+
+    cumulative = np.cumsum(np.where(valid, values, 0), axis=-1)
+    sums = cumulative.copy()
+    sums[..., window:] -= cumulative[..., :-window]
+    counts = _window_counts(valid, window)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+    return np.where(counts >= max(min_valid, 1), means, np.nan)
+
+
+
+def _rolling_extreme(values, window, min_valid, reduce, fill):
+    """
+    Returns the maximum or minimum of each window along the last axis in O(n) with the van Herk/Gil-Werman
+    algorithm: the values are split into blocks the size of the window, and each window's result combines the
+    running extreme from the end of one block with the running extreme from the start of the next.
+
+    Parameters:
+        values (np array): 1D or 2D array of values
+        window (int): number of values in each window
+        min_valid (int): minimum number of valid values for a window to have a result
+        reduce (np.ufunc): np.maximum or np.minimum
+        fill (float): value that never wins, used in place of NaN: -inf for the maximum, inf for the minimum
+    Returns:
+        extremes (np array): float64 array of the same shape, NaN where a window has too few valid values
+    """
+
+    min_valid = _check_window(window, min_valid)
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    length = values.shape[-1]
+
+    # Pad the start so each window ending at a position begins at a valid index, and the end to whole blocks
+    blocks = -(-(length + window - 1) // window)
+    padded = np.full(values.shape[:-1] + (blocks * window,), fill)
+    padded[..., window-1:window-1+length] = np.where(valid, values, fill)
+
+    shaped = padded.reshape(values.shape[:-1] + (blocks, window))
+    from_start = reduce.accumulate(shaped, axis=-1).reshape(padded.shape)
+    from_end = np.flip(reduce.accumulate(np.flip(shaped, axis=-1), axis=-1), axis=-1).reshape(padded.shape)
+
+    # The window ending at padded position j covers positions j - window + 1 to j
+    ends = np.arange(window - 1, window - 1 + length)
+    extremes = reduce(from_end[..., ends - window + 1], from_start[..., ends])
+
+    counts = _window_counts(valid, window)
+    return np.where(counts >= max(min_valid, 1), extremes, np.nan)
+
+
+
+def rolling_max(values, window, min_valid=1):
+    """
+    Returns the maximum of each window of consecutive values ending at each position, ignoring NaN values.
+
+    Parameters:
+        values (np array): 1D array of values, or 2D array with one series per row such as Station.values
+        window (int): number of values in each window
+        min_valid (int): minimum number of valid values for a window to have a maximum
+    Returns:
+        maxima (np array): float64 array of the same shape, NaN where a window has too few valid values
+    """
+    return _rolling_extreme(values, window, min_valid, np.maximum, -np.inf)
+
+
+
+def rolling_min(values, window, min_valid=1):
+    """
+    Returns the minimum of each window of consecutive values ending at each position, ignoring NaN values.
+
+    Parameters:
+        values (np array): 1D array of values, or 2D array with one series per row such as Station.values
+        window (int): number of values in each window
+        min_valid (int): minimum number of valid values for a window to have a minimum
+    Returns:
+        minima (np array): float64 array of the same shape, NaN where a window has too few valid values
+    """
+    return _rolling_extreme(values, window, min_valid, np.minimum, np.inf)
+
+
+
+def rolling_exceedances(values, window, limit):
+    """
+    Returns the number of values above a limit in each window of consecutive values ending at each position, e.g.
+    the number of hours above 200 in the last 24. NaN values never exceed the limit.
+
+    Parameters:
+        values (np array): 1D array of values, or 2D array with one series per row such as Station.values
+        window (int): number of values in each window
+        limit (float): values strictly above the limit are counted
+    Returns:
+        counts (np array): integer array of the same shape
+    """
+
+    _check_window(window, None)
+    with np.errstate(invalid='ignore'):
+        return _window_counts(np.asarray(values, dtype=np.float64) > limit, window)
+
+
+
+def count_exceedances(values, limit, window=1, min_valid=None):
+    """
+    Returns the number of times the running mean of a window exceeds a limit, e.g. the number of hours above an
+    hourly limit with window=1, or of 8-hour running means above a limit with window=8.
+
+    Parameters:
+        values (np array): 1D array of values, or 2D array with one series per row such as Station.values
+        limit (float): running means strictly above the limit are counted
+        window (int): number of values in each window
+        min_valid (int): minimum number of valid values for a window to be counted, the whole window by default
+    Returns:
+        count (int or np array): number of exceedances, or an array with one count per row for a 2D array
+    """
+
+    with np.errstate(invalid='ignore'):
+        exceeded = rolling_mean(values, window, min_valid) > limit
+    return np.count_nonzero(exceeded, axis=-1)
@@ -0,0 +1,167 @@
+import numpy as np
+
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch with a relative error guarantee (a DDSketch). Values are counted in logarithmic bins,
+    where every value in a bin is within the relative accuracy of the bin's centre, so any percentile is estimated
+    within that relative error while the memory used only depends on the range of the values. Sketches of the same
+    accuracy can be merged by adding their counts, e.g. to combine days into months, or the sketches of several
+    stations or worker processes.
+
+    Attributes:
+        relative_accuracy (float): maximum relative error of an estimated percentile, e.g. 0.01 for 1%
+        max_bins (int): maximum number of bins for positive and for negative values, the lowest bins are merged
+                        beyond this (which only affects the accuracy of the lowest percentiles)
+        count (int): number of values added
+    """
+
+    # Values closer to zero than this are counted as zero
+    MIN_VALUE = 1e-9
+
+    def __init__(self, relative_accuracy=0.01, max_bins=2048):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError('The relative accuracy must be between 0 and 1.')
+
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.count = 0
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = np.log(self._gamma)
+
+        # Counts of the positive and negative bins, starting from the bin with the key in the offset
+        self._positive = [np.zeros(0, dtype=np.int64), 0]
+        self._negative = [np.zeros(0, dtype=np.int64), 0]
+        self._zero = 0
+
+
+    def add(self, values):
+        """
+        Adds values to the sketch, ignoring NaN values.
+
+        Parameters:
+            values (np array): array of values
+        """
+
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+
+        positive = values[values >= self.MIN_VALUE]
+        negative = -values[values <= -self.MIN_VALUE]
+        self._zero += len(values) - len(positive) - len(negative)
+        self.count += len(values)
+
+        for store, magnitudes in [(self._positive, positive), (self._negative, negative)]:
+            if len(magnitudes):
+                keys, counts = np.unique(np.ceil(np.log(magnitudes) / self._log_gamma).astype(np.int64),
+                                         return_counts=True)
+                self._add_counts(store, keys[0], keys[-1], keys, counts)
+
+
+    def _add_counts(self, store, low, high, keys, counts):
+        """
+        Adds counts to the bins of one store, extending the store to cover the keys from low to high and merging
+        the lowest bins if there are more than max_bins.
+
+        Parameters:
+            store (list): [counts, offset] of the positive or negative bins
+            low, high (int): lowest and highest key to add
+            keys (np array): key of each count
+            counts (np array): number of values in each key
+        """
+
+        bins, offset = store
+        if len(bins):
+            low = min(low, offset)
+            high = max(high, offset + len(bins) - 1)
+
+        merged = np.zeros(high - low + 1, dtype=np.int64)
+        merged[offset-low:offset-low+len(bins)] = bins
+        np.add.at(merged, keys - low, counts)
+
+        if len(merged) > self.max_bins:
+            extra = len(merged) - self.max_bins
+            merged[extra] += merged[:extra].sum()
+            merged = merged[extra:]
+            low += extra
+
+        store[0] = merged
+        store[1] = low
+
+
+    def merge(self, other):
+        """
+        Adds the counts of another sketch of the same relative accuracy to this one.
+
+        Parameters:
+            other (QuantileSketch)
+        """
+
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError('Only sketches of the same relative accuracy can be merged.')
+
+        for store, (bins, offset) in [(self._positive, other._positive), (self._negative, other._negative)]:
+            if len(bins):
+                self._add_counts(store, offset, offset + len(bins) - 1, np.arange(offset, offset + len(bins)), bins)
+
+        self._zero += other._zero
+        self.count += other.count
+
+
+    def quantile(self, q):
+        """
+        Returns the estimated q-th percentile of the values added, within the relative accuracy of the value at that
+        rank (the nearest lower value, without interpolating between values).
+
+        Parameters:
+            q (float): percentile between 0 and 100
+        Returns:
+            value (float): the estimated percentile, NaN if the sketch is empty
+        """
+
+        if self.count == 0:
+            return np.nan
+        rank = q / 100 * (self.count - 1)
+
+        # Negative values from the most negative, then zeros, then positive values from the smallest
+        negative, negative_offset = self._negative
+        cumulative = np.cumsum(negative[::-1])
+        if len(cumulative) and rank < cumulative[-1]:
+            key = negative_offset + len(negative) - 1 - np.searchsorted(cumulative, rank, side='right')
+            return -self._value(key)
+
+        rank -= cumulative[-1] if len(cumulative) else 0
+        if rank < self._zero:
+            return 0.0
+
+        rank -= self._zero
+        positive, positive_offset = self._positive
+        cumulative = np.cumsum(positive)
+        index = min(np.searchsorted(cumulative, rank, side='right'), len(positive) - 1)
+        return self._value(positive_offset + index)
+
+
+    def _value(self, key):
+        """
+        Returns the value representing a bin, within the relative accuracy of every value in the bin.
+        """
+        return float(2 * self._gamma ** key / (self._gamma + 1))
+
+
+
+def merge_sketches(sketches):
+    """
+    Merges several sketches into a new one, e.g. the daily sketches of a month or the sketches of several stations.
+
+    Parameters:
+        sketches (iterable): QuantileSketch objects of the same relative accuracy
+    Returns:
+        sketch (QuantileSketch): sketch of all the values added to any of the sketches
+    """
+
+    sketches = list(sketches)
+    merged = QuantileSketch(sketches[0].relative_accuracy, sketches[0].max_bins) if sketches else QuantileSketch()
+    for sketch in sketches:
+        merged.merge(sketch)
+    return merged
@@ -0,0 +1,277 @@
+import datetime
+import json
+import os
+import tempfile
+import numpy as np
+import requests
+from londonair import CACHE, RECENT_DAYS, _as_list, date_chunks, fetch_all, normalise_url, site_species_url
+
+
+
+def month_means(timestamps, values):
+    """
+    Returns the mean value of each month of some timestamps and values, ignoring NaN values.
+
+    Parameters:
+        timestamps (np array): datetime64 array of the time of each value
+        values (np array): float64 array of values
+    Returns:
+        means (dict): dictionary of month (str, YYYY-MM): mean value, for each month with data in order
+    """
+
+    valid = ~np.isnan(values)
+    months, codes = np.unique(timestamps[valid].astype('datetime64[M]'), return_inverse=True)
+    sums = np.bincount(codes, weights=values[valid], minlength=len(months))
+    counts = np.bincount(codes, minlength=len(months))
+    return {str(month): float(total / count) for month, total, count in zip(months, sums, counts)}
+
+
+
+def _row_arrays(data):
+    """
+    Returns the timestamps and values of a raw data response.
+
+    Parameters:
+        data (dict): parsed json response of a site and species
+    Returns:
+        (timestamps, values) (tuple): datetime64[m] array of the timestamps, and float64 array of the values with
+                                      NaN for records with no value
+    """
+
+    rows = _as_list(data['RawAQData'].get('Data'))
+
+    timestamps = np.array([row['@MeasurementDateGMT'] for row in rows], dtype='datetime64[m]')
+    values = np.array([float(row['@Value']) if row['@Value'] != '' else np.nan for row in rows], dtype=np.float64)
+    return (timestamps, values)
+
+
+
+class SnapshotStore:
+    """
+    Local store of the raw data fetched from the API, partitioned into one .npz file of timestamps and values per
+    site, species and month. Ranges are read from disk first and only the months that are missing, or were still
+    open when they were fetched, are requested from the API, so historic data is fetched once and reports can run
+    from what is stored when there is no network.
+
+    Attributes:
+        directory (str): root directory of the partitions
+    """
+
+    def __init__(self, directory=os.path.join('data', 'snapshots')):
+        self.directory = directory
+
+
+    def _path(self, site_code, species_code, month):
+        """
+        Returns the file of the partition of a site, species and month.
+        """
+        return os.path.join(self.directory, site_code, species_code, f'{month}.npz')
+
+
+    def _read(self, site_code, species_code, month):
+        """
+        Reads the partition of a site, species and month.
+
+        Returns:
+            (timestamps, values, complete) (tuple): arrays of the month, and whether it was closed when it was
+                                                    fetched, or None if the month is not stored
+        """
+
+        try:
+            with np.load(self._path(site_code, species_code, month)) as partition:
+                return (partition['timestamps'], partition['values'], bool(partition['complete']))
+        except OSError:
+            return None
+
+
+    def write(self, site_code, species_code, timestamps, values, complete=None):
+        """
+        Adds timestamps and values to the partitions of a site and species, replacing any stored values with the
+        same timestamps.
+
+        Parameters:
+            site_code (str): string that corresponds to the site
+            species_code (str): string that corresponds to the pollutant
+            timestamps (np array): datetime64 array of the time of each value
+            values (np array): float64 array of values, NaN for no value
+            complete (bool): whether the months are closed, decided from today's date by default
+        """
+
+        timestamps = np.asarray(timestamps).astype('datetime64[m]')
+        values = np.asarray(values, dtype=np.float64)
+        months = timestamps.astype('datetime64[M]')
+        closed_before = np.datetime64(datetime.date.today() - datetime.timedelta(days=RECENT_DAYS), 'D')
+
+        for month in np.unique(months):
+            in_month = months == month
+            month_timestamps, month_values = timestamps[in_month], values[in_month]
+
+            stored = self._read(site_code, species_code, month)
+            if stored is not None:
+                month_timestamps = np.concatenate([stored[0], month_timestamps])
+                month_values = np.concatenate([stored[1], month_values])
+
+            # Keep the last value of each timestamp, i.e. the new one
+            order = np.argsort(month_timestamps, kind='stable')
+            month_timestamps, month_values = month_timestamps[order], month_values[order]
+            last = np.append(month_timestamps[1:] != month_timestamps[:-1], True)
+
+            is_complete = complete
+            if is_complete is None:
+                is_complete = (month + 1).astype('datetime64[D]') <= closed_before
+            self._save(site_code, species_code, month, month_timestamps[last], month_values[last], is_complete)
+
+
+    def _save(self, site_code, species_code, month, timestamps, values, complete):
+        """
+        Writes the partition of a site, species and month to a temporary file first, so readers never see a partly
+        written month.
+        """
+
+        path = self._path(site_code, species_code, month)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(handle, 'wb') as f:
+            np.savez(f, timestamps=timestamps, values=values, complete=complete)
+        os.replace(temporary, path)
+
+
+    def missing(self, site_code, species_code, start_date, end_date):
+        """
+        Returns the whole months of a range that have to be fetched: those not stored, or still open when fetched.
+
+        Parameters:
+            site_code (str): string that corresponds to the site
+            species_code (str): string that corresponds to the pollutant
+            start_date, end_date (datetime.date): first date and the date after the last one
+        Returns:
+            chunks (list): list of (start_date, end_date) pairs of the months to fetch
+        """
+
+        # Months are fetched whole, even if the range starts or ends part way through one
+        first = start_date.replace(day=1)
+        last = end_date.replace(day=1)
+        if last < end_date:
+            last = datetime.date(last.year + last.month // 12, last.month % 12 + 1, 1)
+
+        missing = []
+        for start, end in date_chunks(first, last):
+            stored = self._read(site_code, species_code, np.datetime64(start, 'M'))
+            if stored is None or not stored[2]:
+                missing.append((start, end))
+        return missing
+
+
+    def read(self, site_code, species_code, start_date, end_date):
+        """
+        Returns the stored timestamps and values of a site and species between two dates.
+
+        Parameters:
+            site_code (str): string that corresponds to the site
+            species_code (str): string that corresponds to the pollutant
+            start_date, end_date (datetime.date): first date and the date after the last one
+        Returns:
+            (timestamps, values) (tuple): datetime64[m] array of the timestamps in order, and float64 array of the
+                                          values
+        """
+
+        timestamps = [np.array([], dtype='datetime64[m]')]
+        values = [np.array([])]
+        for start, _ in date_chunks(start_date, end_date):
+            stored = self._read(site_code, species_code, np.datetime64(start, 'M'))
+            if stored is not None:
+                timestamps.append(stored[0])
+                values.append(stored[1])
+
+        timestamps, values = np.concatenate(timestamps), np.concatenate(values)
+        in_range = ((timestamps >= np.datetime64(start_date, 'm')) & (timestamps < np.datetime64(end_date, 'm')))
+        return (timestamps[in_range], values[in_range])
+
+
+    def load(self, site_code, species_code, start_date, end_date, fetch=True, workers=8, retries=3, cache=CACHE):
+        """
+        Returns the timestamps and values of a site and species between two dates, fetching the missing and open
+        months from the API at once and storing them first. Open months are fetched through the response cache, so
+        they are only requested again once their short time to live has passed. Closed months are stored here for
+        good, so unless they are already cached they are parsed into arrays as they arrive instead, without
+        building the whole response as dictionaries. Failed requests are retried, and a month that cannot be
+        fetched, because the API is unreachable or the request still fails after its retries, is read from what is
+        stored.
+
+        Parameters:
+            site_code (str): string that corresponds to the site
+            species_code (str): string that corresponds to the pollutant
+            start_date, end_date (datetime.date): first date and the date after the last one
+            fetch (bool): whether to fetch missing months, False to only read what is stored (e.g. offline)
+            workers (int): maximum number of months fetched at once
+            retries (int): number of times a failed request is retried
+            cache (ResponseCache): cache of responses, None to always fetch the months
+        Returns:
+            (timestamps, values) (tuple): datetime64[m] array of the timestamps in order, and float64 array of the
+                                          values
+        """
+
+        # Months that have not started yet have no data to fetch
+        today = datetime.date.today()
+        missing = self.missing(site_code, species_code, start_date, end_date) if fetch else []
+        missing = [(start, end) for start, end in missing if start <= today]
+
+        # Closed months not in the cache are streamed into arrays, the others are fetched through the cache
+        closed_before = today - datetime.timedelta(days=RECENT_DAYS)
+        urls = {(start, end): site_species_url(site_code, species_code, start, end) for start, end in missing}
+        streamed = {key: url for key, url in urls.items() 
+                    if key[1] <= closed_before and (cache is None or cache.get(normalise_url(url)) is None)}
+        cached = {key: url for key, url in urls.items() if key not in streamed}
+
+        responses = fetch_all(cached, concurrency=workers, retries=retries, cache=cache, return_exceptions=True)
+        responses.update(fetch_all(streamed, concurrency=workers, retries=retries, return_exceptions=True, 
+                                   stream=True))
+
+        for (start, end), data in responses.items():
+            if isinstance(data, requests.RequestException):
+                continue
+            if isinstance(data, Exception):
+                raise data
+
+            # Only keep the month requested, and store a month with no data so it is not fetched again
+            timestamps, values = data if isinstance(data, tuple) else _row_arrays(data)
+            month = np.datetime64(start, 'M')
+            in_month = timestamps.astype('datetime64[M]') == month
+            if np.any(in_month):
+                self.write(site_code, species_code, timestamps[in_month], values[in_month])
+            elif self._read(site_code, species_code, month) is None:
+                closed = end <= closed_before
+                self._save(site_code, species_code, month, timestamps[in_month], values[in_month], closed)
+
+        return self.read(site_code, species_code, start_date, end_date)
+
+
+    def import_json(self, filename, site_code=None, species_code=None):
+        """
+        Imports a previously fetched raw data response saved as json, either the response itself or an entry of
+        the response cache.
+
+        Parameters:
+            filename (str): path of the json file
+            site_code (str): site of the data, read from the response by default
+            species_code (str): pollutant of the data, read from the response by default
+        Returns:
+            rows (int): number of values imported
+        """
+
+        with open(filename) as f:
+            data = json.load(f)
+
+        # Entries of the response cache hold the response in 'data'
+        data = data.get('data', data)
+        site_code = site_code or data['RawAQData']['@SiteCode']
+        species_code = species_code or data['RawAQData']['@SpeciesCode']
+
+        timestamps, values = _row_arrays(data)
+        self.write(site_code, species_code, timestamps, values)
+        return len(timestamps)
+
+
+
+# Shared store of the monitoring functions
+SNAPSHOTS = SnapshotStore()
@@ -0,0 +1,581 @@
+import hashlib
+import itertools
+import os
+import shutil
+import tempfile
+import numpy as np
+
+
+MISSING = 'No data'
+
+# Number of buckets for each grouping of the rows, see Station.group_codes
+GROUPS = {'hour': 24, 'weekday': 7, 'month': 12, 'season': 4}
+
+
+
+class Station:
+    """
+    Typed, column-oriented pollution data for a single monitoring station. Each pollutant is parsed once into a
+    contiguous float64 array, with NaN in place of 'No data' and a matching boolean missing-value mask.
+
+    Attributes:
+        name (str): name of the monitoring station
+        header (list): column names of the original data, e.g. ['date', 'time', 'no', 'pm10', 'pm25']
+        pollutants (list): names of the pollutant columns
+        index (dict): dictionary of pollutant: position of its column in values and missing
+        dates (np array): datetime64[D] date of each row, as written in the data
+        hours (np array): uint8 hour of each row, from 1 to 24
+        timestamps (np array): datetime64[h] time at the end of each hourly reading
+        values (np array): 2D float64 array of shape (pollutants, rows), NaN where there is no data
+        missing (np array): 2D boolean array of shape (pollutants, rows), True where there is no data
+    """
+
+    def __init__(self, name, header, dates, hours, values, missing=None):
+        self.name = name
+        self.header = list(header)
+        self.pollutants = self.header[2:]
+
+        # Resolve the position of each pollutant's column once
+        self.index = {pollutant: i for i, pollutant in enumerate(self.pollutants)}
+        self.dates = np.asarray(dates, dtype='datetime64[D]')
+        self.hours = np.asarray(hours, dtype=np.uint8)
+        self.timestamps = self.dates.astype('datetime64[h]') + self.hours.astype('timedelta64[h]')
+
+        # Store each pollutant as one contiguous row of the array
+        self.values = np.ascontiguousarray(values, dtype=np.float64).reshape(len(self.pollutants), -1)
+        self.missing = np.isnan(self.values) if missing is None else missing
+        self._codes = {}
+        self._days = None
+
+        # Cache directory the columns were memory-mapped from, if any
+        self.source = None
+
+        # Number of bytes of the csv file read so far, if the station was read from a file, and where the last row
+        # starts if it had no line break yet, as more of it may still be written
+        self.consumed = None
+        self.pending = None
+
+
+    @classmethod
+    def from_rows(cls, name, header, rows):
+        """
+        Parses rows of strings in the format of the pollution csv files into a Station.
+
+        Parameters:
+            name (str): name of the monitoring station
+            header (list): column names, e.g. ['date', 'time', 'no', 'pm10', 'pm25']
+            rows (iterable): lists of strings in the form [date, time, value, value, ...]
+        Returns:
+            station (Station): typed data for the monitoring station
+        """
+
+        dates = []
+        hours = []
+        cells = []
+        for row in rows:
+            # Skip blank lines
+            if not row or row == ['']:
+                continue
+            dates.append(row[0])
+            hours.append(row[1][:2])
+            cells.append(row[2:])
+
+        # Replace 'No data' so that every cell can be converted to a float in one go
+        cells = np.array(cells, dtype=str).reshape(len(cells), len(header) - 2)
+        cells[cells == MISSING] = 'nan'
+
+        return cls(name, header, np.array(dates, dtype='datetime64[D]'), np.array(hours).astype(np.uint8),
+                   cells.astype(np.float64).T)
+
+
+    @classmethod
+    def from_csv(cls, name, filename, cache_dir=None):
+        """
+        Reads and parses a pollution csv file into a Station. If a cache directory is given, the parsed columns are
+        saved there as .npy files the first time, and memory-mapped instead of parsing the file again afterwards 
+        for as long as the file's size and modification time are unchanged.
+
+        Parameters:
+            name (str): name of the monitoring station
+            filename (str): path of the csv file
+            cache_dir (str): directory of the binary cache, or None to always parse the file
+        Returns:
+            station (Station): typed data for the monitoring station
+        """
+
+        if cache_dir is not None:
+            path = _cache_path(filename, cache_dir)
+            if os.path.isdir(path):
+                station = cls._from_cache(name, path)
+                try:
+                    with open(os.path.join(path, 'consumed.txt')) as f:
+                        offsets = [int(offset) for offset in f.read().split()]
+                    station.consumed = offsets[0]
+                    station.pending = offsets[1] if len(offsets) > 1 else None
+                except OSError:
+                    station.consumed = os.path.getsize(filename)
+                return station
+
+        with open(filename, 'rb') as f:
+            header_line = f.readline()
+            text = f.read()
+
+        header = header_line.decode().strip().split(',')
+        lines, end, last = _complete_lines(text, len(header))
+        station = cls.from_rows(name, header, (line.strip().split(',') for line in lines))
+        station.consumed = len(header_line) + end
+        station.pending = None if last is None else len(header_line) + last
+
+        if cache_dir is not None:
+            station._save_cache(path)
+        return station
+
+
+    @classmethod
+    def _from_cache(cls, name, path):
+        """
+        Memory-maps the columns of a station saved by _save_cache, so they are read from disk only as needed and
+        shared between processes loading the same file.
+
+        Parameters:
+            name (str): name of the monitoring station
+            path (str): directory of the cached columns
+        Returns:
+            station (Station): typed data for the monitoring station
+        """
+
+        with open(os.path.join(path, 'header.txt')) as f:
+            header = f.read().split(',')
+
+        columns = {column: np.load(os.path.join(path, f'{column}.npy'), mmap_mode='r')
+                   for column in ['dates', 'hours', 'values', 'missing']}
+        station = cls(name, header, columns['dates'], columns['hours'], columns['values'], columns['missing'])
+        station.source = path
+        return station
+
+
+    def __reduce__(self):
+        """
+        Pickles a station loaded from the binary cache as the location of its files, so that worker processes 
+        memory-map the same files instead of receiving a copy of the data.
+        """
+
+        if self.source is not None:
+            return (Station._from_cache, (self.name, self.source))
+        return (Station, (self.name, self.header, self.dates, self.hours, self.values, self.missing))
+
+
+    def _save_cache(self, path):
+        """
+        Saves the header and columns of the station to a cache directory as .npy files. The files are written to a
+        temporary directory first, so other processes never see a partly written cache, and the older versions of
+        the same file are then removed, see _cache_path.
+
+        Parameters:
+            path (str): directory of the cached columns
+        """
+
+        parent = os.path.dirname(path)
+        os.makedirs(parent, exist_ok=True)
+        temporary = tempfile.mkdtemp(dir=parent, prefix='tmp')
+
+        with open(os.path.join(temporary, 'header.txt'), 'w') as f:
+            f.write(','.join(self.header))
+        if self.consumed is not None:
+            with open(os.path.join(temporary, 'consumed.txt'), 'w') as f:
+                f.write(str(self.consumed) if self.pending is None else f'{self.consumed} {self.pending}')
+        for column in ['dates', 'hours', 'values', 'missing']:
+            np.save(os.path.join(temporary, f'{column}.npy'), getattr(self, column))
+
+        try:
+            os.rename(temporary, path)
+        except OSError:
+            # Another process has already written the same cache
+            shutil.rmtree(temporary, ignore_errors=True)
+            return
+
+        # Leave the temporary directories of other processes still writing
+        for version in os.listdir(parent):
+            if version != os.path.basename(path) and not version.startswith('tmp'):
+                shutil.rmtree(os.path.join(parent, version), ignore_errors=True)
+
+
+    def __len__(self):
+        return len(self.dates)
+
+
+    def column_index(self, pollutant):
+        """
+        Returns the position of a pollutant's column, raises an exception if the pollutant is not in the data.
+
+        Parameters:
+            pollutant (str)
+        Returns:
+            index (int): position of the pollutant in values and missing
+        """
+        try:
+            return self.index[pollutant]
+        except KeyError:
+            raise ValueError(f"No column for pollutant '{pollutant}' in {self.name}.") from None
+
+
+    def column(self, pollutant):
+        """
+        Returns the float64 array of values for a pollutant, with NaN for any missing data.
+
+        Parameters:
+            pollutant (str)
+        Returns:
+            values (np array): 1D float64 array of the pollutant's values
+        """
+        return self.values[self.column_index(pollutant)]
+
+
+    def missing_mask(self, pollutant):
+        """
+        Returns the boolean mask of missing values for a pollutant.
+
+        Parameters:
+            pollutant (str)
+        Returns:
+            missing (np array): 1D boolean array, True where there is no data
+        """
+        return self.missing[self.column_index(pollutant)]
+
+    def with_values(self, values, pollutants=None):
+        """
+        Returns a Station with new values that shares the dates, hours, timestamps and any computed indexes of this
+        one, rather than copying or recomputing them.
+
+        Parameters:
+            values (np array): 2D float64 array of shape (pollutants, rows)
+            pollutants (list): pollutants of the rows of values, the same pollutants as this station by default
+        Returns:
+            station (Station): the station with the new values
+        """
+
+        station = Station.__new__(Station)
+        station.__dict__.update(self.__dict__)
+        if pollutants is not None:
+            station.header = self.header[:2] + list(pollutants)
+            station.pollutants = station.header[2:]
+            station.index = {pollutant: i for i, pollutant in enumerate(station.pollutants)}
+
+        station.values = np.ascontiguousarray(values, dtype=np.float64).reshape(len(station.pollutants), -1)
+        station.missing = np.isnan(station.values)
+        station.source = None
+        return station
+
+
+    def append(self, other):
+        """
+        Returns a Station with the rows of another station of the same pollutants added to the end.
+
+        Parameters:
+            other (Station): the new rows
+        Returns:
+            station (Station): the station with every row
+        """
+
+        if other.header != self.header:
+            raise ValueError(f'The new rows of {self.name} have different columns.')
+
+        station = Station(self.name, self.header, np.concatenate([self.dates, other.dates]), 
+                          np.concatenate([self.hours, other.hours]), np.concatenate([self.values, other.values], axis=1),
+                          np.concatenate([self.missing, other.missing], axis=1))
+        station.consumed = self.consumed
+        station.pending = self.pending
+        return station
+
+
+    def head(self, rows):
+        """
+        Returns a Station with only the first rows of this one.
+
+        Parameters:
+            rows (int): number of rows to keep
+        Returns:
+            station (Station): the station with the first rows
+        """
+
+        station = Station(self.name, self.header, self.dates[:rows], self.hours[:rows], self.values[:, :rows],
+                          self.missing[:, :rows])
+        station.consumed = self.consumed
+        station.pending = self.pending
+        return station
+
+
+    def day_rows(self, date):
+        """
+        Returns the rows of a given date. The first row of each day is indexed on the first call, after which
+        every lookup is a binary search over the days rather than a scan of the rows.
+
+        Parameters:
+            date (str): date in the format YYYY-MM-DD
+        Returns:
+            rows (slice): slice of the rows for the date, empty if the date is not in the data
+        """
+
+        if self._days is None:
+            # The data is ordered by date, so each day is one contiguous block of rows
+            if np.any(self.dates[1:] < self.dates[:-1]):
+                raise ValueError(f'The data of {self.name} is not ordered by date.')
+            days, starts = np.unique(self.dates, return_index=True)
+            self._days = (days, np.append(starts, len(self)))
+
+        days, starts = self._days
+        date = np.datetime64(date, 'D')
+        i = np.searchsorted(days, date)
+        if i == len(days) or days[i] != date:
+            return slice(0, 0)
+        return slice(int(starts[i]), int(starts[i+1]))
+
+
+    def group_codes(self, by):
+        """
+        Returns the bucket of each row for a grouping, computed on the first call and reused afterwards. The groupings
+        are 'hour' (0 to 23 for hours 1 to 24), 'weekday' (0 for Monday to 6 for Sunday), 'month' (0 to 11) and 
+        'season' (0 for winter, 1 spring, 2 summer, 3 autumn), all taken from the date and hour in the data.
+
+        Parameters:
+            by (str): name of the grouping, one of GROUPS
+        Returns:
+            codes (np array): uint8 array of the bucket of each row
+        """
+
+        if by not in GROUPS:
+            raise ValueError(f"Unknown grouping '{by}', choose from {', '.join(GROUPS)}.")
+
+        if by not in self._codes:
+            if by == 'hour':
+                codes = self.hours - 1
+            elif by == 'weekday':
+                # 1970-01-01 was a Thursday
+                codes = (self.dates.astype(np.int64) + 3) % 7
+            else:
+                codes = self.dates.astype('datetime64[M]').astype(np.int64) % 12
+                if by == 'season':
+                    # December to February is winter, March to May is spring and so on
+                    codes = (codes + 1) % 12 // 3
+            self._codes[by] = codes.astype(np.uint8)
+
+        return self._codes[by]
+
+
+
+def _cache_path(filename, cache_dir):
+    """
+    Returns the cache directory of a csv file: a directory named after the file's absolute path, holding one
+    version named after the file's size and modification time, so any change to the file uses a new version.
+
+    Parameters:
+        filename (str): path of the csv file
+        cache_dir (str): directory of the binary cache
+    Returns:
+        path (str): directory of the cached columns of the file
+    """
+
+    status = os.stat(filename)
+    key = hashlib.sha1(os.path.abspath(filename).encode()).hexdigest()
+    return os.path.join(cache_dir, key, f'{status.st_size}-{status.st_mtime_ns}')
+
+
+
+def read_chunks(name, filename, chunk_size=100000):
+    """
+    Reads a pollution csv file a chunk of rows at a time, so that files larger than memory can be processed. Only
+    one chunk is held in memory at once.
+
+    Parameters:
+        name (str): name of the monitoring station
+        filename (str): path of the csv file
+        chunk_size (int): maximum number of rows in each chunk
+    Returns:
+        yields Station objects with the rows of each chunk, in the order of the file
+    """
+
+    with open(filename) as f:
+        header = f.readline().strip().split(',')
+        rows = (line.strip().split(',') for line in f)
+
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                return
+            yield Station.from_rows(name, header, chunk)
+
+
+
+def _is_row(cells, fields):
+    """
+    Returns whether the cells of a line form a whole row of a pollution csv file: a date, a time and a number or
+    'No data' for each pollutant.
+
+    Parameters:
+        cells (list): strings of the line
+        fields (int): number of columns in the header
+    Returns:
+        is_row (bool)
+    """
+
+    if len(cells) != fields or not all(cells):
+        return False
+    try:
+        np.datetime64(cells[0], 'D')
+        int(cells[1][:2])
+        [float(cell) for cell in cells[2:] if cell != MISSING]
+    except ValueError:
+        return False
+    return True
+
+
+
+def _complete_lines(text, fields):
+    """
+    Returns the complete lines of some bytes read from a pollution csv file, the same way for a first read and for
+    rows appended later. Everything up to the last line break is complete. The files are written with a line break
+    before each row rather than after it, so a last line without a line break is also read once it is a whole row,
+    see _is_row, and is otherwise a row still being written that is left for the next read. As its last value may
+    still grow (e.g. 1 before 15 is written), the start of a last line read without a line break is returned so it
+    can be read again.
+
+    Parameters:
+        text (bytes): bytes read from the file, after the header
+        fields (int): number of columns in the header
+    Returns:
+        (lines, end, last) (tuple): list of the complete lines, the number of bytes of text they take up, and the
+                                    position in text of the last line if it had no line break, otherwise None
+    """
+
+    end = text.rfind(b'\n') + 1
+    last = text[end:].decode(errors='replace').strip()
+    if last and _is_row(last.split(','), fields):
+        return (text.decode().splitlines(), len(text), end)
+
+    return (text[:end].decode().splitlines(), end, None)
+
+
+
+def read_new_rows(name, filename, consumed, pending=None):
+    """
+    Reads the complete lines added to a pollution csv file since a given number of bytes had been read, see
+    _complete_lines. A line still being written is left for the next read. If the last row read had no line break
+    and more of it has been written since, it is read again as the first of the new rows.
+
+    Parameters:
+        name (str): name of the monitoring station
+        filename (str): path of the csv file
+        consumed (int): number of bytes of the file already read
+        pending (int): position in the file of the last row read if it had no line break, otherwise None
+    Returns:
+        (station, consumed, pending, replaced) (tuple): Station of the new rows, the number of bytes of the file
+                                                        read so far, the position of the last row if it has no line
+                                                        break, and whether the first new row replaces the last row
+                                                        read before
+    """
+
+    with open(filename, 'rb') as f:
+        header = f.readline().decode().strip().split(',')
+        f.seek(consumed)
+        text = f.read()
+
+        # The last row is final once a line break follows it, and is read again if anything else does
+        replaced = pending is not None and text[:1] not in [b'', b'\r', b'\n']
+        if replaced:
+            f.seek(pending)
+            text = f.read()
+
+    if not text:
+        return (Station.from_rows(name, header, []), consumed, pending, False)
+
+    start = pending if replaced else consumed
+    lines, end, last = _complete_lines(text, len(header))
+    rows = Station.from_rows(name, header, (line.strip().split(',') for line in lines))
+    return (rows, start + end, None if last is None else start + last, replaced)
+
+
+
+class StationStore(dict):
+    """
+    Dictionary of monitoring station name: Station, used in place of the lists of strings read from the csv files.
+    Each station is parsed only once, so the same store can be passed to any number of reporting functions.
+    """
+
+    @classmethod
+    def from_files(cls, filenames, directory='data', cache_dir=None):
+        """
+        Loads the pollution csv files for each monitoring station into a StationStore.
+
+        Parameters:
+            filenames (list): names of the files without the extension, e.g. ['Pollution-London Harlington']
+            directory (str): directory containing the files
+            cache_dir (str): directory of the binary cache of the parsed files, see Station.from_csv
+        Returns:
+            store (StationStore): dictionary of station name: Station
+        """
+
+        store = cls()
+        for filename in filenames:
+            store[filename] = Station.from_csv(filename, f'{directory}/{filename}.csv', cache_dir)
+            store.files[filename] = f'{directory}/{filename}.csv'
+        return store
+
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # Path of the csv file of each station read from a file
+        self.files = {}
+
+
+    def copy(self):
+        """
+        Returns a shallow copy of the store that keeps the stations' files, so it can still be refreshed.
+
+        Returns:
+            store (StationStore): dictionary of station name: Station
+        """
+
+        store = type(self)(self)
+        store.files = dict(self.files)
+        return store
+
+
+    def refresh(self):
+        """
+        Reads the rows added to the end of each station's csv file since it was last read, without parsing the 
+        earlier rows again, and adds them to the stations. A last row read before its line break that has grown
+        since is replaced, and is then the first of the new rows.
+
+        Returns:
+            new_rows (dict): dictionary of station name: Station of only the new rows
+        """
+
+        new_rows = {}
+        for name, filename in self.files.items():
+            station = self[name]
+            rows, consumed, pending, replaced = read_new_rows(name, filename, station.consumed, station.pending)
+            if replaced:
+                station = station.head(len(station) - 1)
+            if len(rows):
+                station = station.append(rows)
+            station.consumed = consumed
+            station.pending = pending
+            self[name] = station
+            new_rows[name] = rows
+
+        return new_rows
+
+
+    @classmethod
+    def from_rows(cls, data):
+        """
+        Converts the dictionary of lists of strings read from the csv files into a StationStore, without modifying
+        the original data.
+
+        Parameters:
+            data (dict): dictionary of station name: rows, where the first row is the header
+        Returns:
+            store (StationStore): dictionary of station name: Station
+        """
+        return cls({name: Station.from_rows(name, rows[0], rows[1:]) for name, rows in data.items()})
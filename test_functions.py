@@ -1,5 +1,17 @@
+import csv
+import datetime
+import json
+import pickle
+import threading
 import pytest
-from utils import sumvalues, maxvalue, minvalue, meannvalue, countvalue
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from utils import sumvalues, maxvalue, minvalue, meannvalue, countvalue, describevalues
+import array
+from stations import StationStore
+from rolling import rolling_mean, rolling_max, rolling_min, rolling_exceedances, count_exceedances
+from reporting import daily_average, daily_median, daily_statistics, group_statistics, hourly_average, count_missing_data, fill_missing_data, batch_report, peak_hour_date, peak_hours, fill_gaps, stream_statistics, IncrementalReport, period_sketches, period_percentiles
+from sketches import QuantileSketch, merge_sketches
 
 def test_sumvalues():
     assert sumvalues([1, 2, 3]) == 6
@@ -39,4 +51,550 @@ def test_meanvalue():
 
 def test_countvalue():
     assert countvalue([1, 1, 1, 2], 1) == 3
-    assert countvalue([[1, 2, 3], [1, 1, 1]], 1) == 0
\ No newline at end of file
+    assert countvalue([[1, 2, 3], [1, 1, 1]], 1) == 0
+
+def write_station(tmp_path, rows):
+    with open(tmp_path / 'Station.csv', 'w') as f:
+        f.write('date,time,no,pm10\n')
+        for row in rows:
+            f.write(','.join(row) + '\n')
+    return StationStore.from_files(['Station'], tmp_path)
+
+def test_station_store(tmp_path):
+    store = write_station(tmp_path, [['2021-01-01', '01:00:00', '1.5', 'No data'],
+                                     ['2021-01-01', '24:00:00', '2.5', '4']])
+    station = store['Station']
+    assert station.pollutants == ['no', 'pm10']
+    assert station.column('no').tolist() == [1.5, 2.5]
+    assert station.missing_mask('pm10').tolist() == [True, False]
+    assert str(station.timestamps[1]) == '2021-01-02T00'
+    assert daily_average(store, 'Station', 'no') == [2]
+    assert count_missing_data(store, 'Station', 'pm10') == 1
+    filled = fill_missing_data(store, 0.0, 'Station', 'pm10')
+    assert isinstance(filled, StationStore) and filled.files == store.files
+    assert filled['Station'].column('pm10').tolist() == [0, 4]
+
+def test_reporting_keeps_header():
+    data = {'Station': [['date', 'time', 'no'], ['2021-01-01', '01:00:00', 'No data'], ['2021-01-01', '02:00:00', '3']]}
+    assert count_missing_data(data, 'Station', 'no') == 1
+    assert count_missing_data(data, 'Station', 'no') == 1
+    filled = fill_missing_data(data, 0.0, 'Station', 'no')
+    assert filled['Station'][1] == ['2021-01-01', '01:00:00', 0.0]
+    assert data['Station'][0] == ['date', 'time', 'no']
+    assert data['Station'][1][2] == 'No data'
+    with pytest.raises(ValueError):
+        daily_average(data, 'Station', 'pm10')
+
+def test_daily_statistics(tmp_path):
+    rows = [['2021-01-01', f'{h:02}:00:00', str(h), 'No data'] for h in range(1, 25)]
+    rows += [['2021-01-02', f'{h:02}:00:00', 'No data' if h % 2 else str(h), 'No data'] for h in range(1, 25)]
+    store = write_station(tmp_path, rows)
+    statistics = daily_statistics(store, 'Station', 'no', percentiles=(90,))
+    assert statistics['count'].tolist() == [24, 12]
+    assert statistics['min'].tolist() == [1, 2]
+    assert statistics['max'].tolist() == [24, 24]
+    assert statistics['median'].tolist() == [12.5, 13]
+    assert statistics['p90'][0] == np.percentile(np.arange(1, 25), 90)
+    assert daily_median(store, 'Station', 'no') == [12.5, 13]
+    assert np.isnan(daily_statistics(store, 'Station', 'pm10')['mean']).all()
+
+def test_group_statistics(tmp_path):
+    store = write_station(tmp_path, [['2021-01-04', '01:00:00', '2', '1'], ['2021-01-04', '02:00:00', 'No data', '1'],
+                                     ['2021-06-05', '01:00:00', '4', '1']])
+    statistics = group_statistics(store, 'Station', 'no', 'weekday')
+    assert statistics['count'].tolist() == [1, 0, 0, 0, 0, 1, 0]
+    assert statistics['sum'][5] == 4
+    assert group_statistics(store, 'Station', 'no', 'season')['mean'].tolist()[::2] == [2, 4]
+    assert hourly_average(store, 'Station', 'no')[0] == 3
+    with pytest.raises(ValueError):
+        group_statistics(store, 'Station', 'no', 'year')
+
+def test_batch_report(tmp_path):
+    store = write_station(tmp_path, [['2021-01-01', '01:00:00', '1', 'No data'], ['2021-01-01', '02:00:00', '3', '5'],
+                                     ['2021-01-02', '01:00:00', 'No data', 'No data']])
+    report = batch_report(store)
+    assert report['Station']['date'].tolist() == [np.datetime64('2021-01-01'), np.datetime64('2021-01-02')]
+    assert report['Station']['no']['daily_average'][0] == 2
+    assert report['Station']['no']['peak_hour'].tolist() == [2, 0]
+    assert report['Station']['pm10']['count_missing_data'] == 2
+    assert report['Station']['pm10']['hourly_average'][1] == 5
+    assert list(batch_report(store, pollutants=['no'], statistics=['monthly_average'])['Station']['no']) == ['monthly_average']
+    with pytest.raises(ValueError):
+        batch_report(store, statistics=['mode'])
+
+def test_peak_hours(tmp_path):
+    store = write_station(tmp_path, [['2021-01-01', '01:00:00', '0', 'No data'], ['2021-01-01', '02:00:00', '0', 'No data'],
+                                     ['2021-01-02', '01:00:00', '1', 'No data'], ['2021-01-02', '02:00:00', '7', '2']])
+    assert peak_hour_date(store, '2021-01-01', 'Station', 'no') == ('01:00', 0)
+    assert peak_hour_date(store, '2021-01-02', 'Station', 'no') == ('02:00', 7)
+    assert peak_hour_date(store, '2021-01-01', 'Station', 'pm10') is None
+    assert peak_hour_date(store, '2021-01-03', 'Station', 'no') is None
+    peaks = peak_hours(store, 'Station', 'pm10', start_date='2021-01-02')
+    assert peaks['peak_hour'].tolist() == [2]
+    assert peaks['peak_value'].tolist() == [2]
+
+def test_fill_gaps(tmp_path):
+    store = write_station(tmp_path, [['2021-01-01', '01:00:00', 'No data', '1'], ['2021-01-01', '02:00:00', '2', '1'],
+                                     ['2021-01-01', '03:00:00', 'No data', '1'], ['2021-01-01', '04:00:00', '6', '1'],
+                                     ['2021-01-02', '01:00:00', '4', '1']])
+    station = store['Station']
+    assert fill_gaps(station, 'no', 'constant', 0).tolist() == [0, 2, 0, 6, 4]
+    assert fill_gaps(station, 'no', 'forward', -1).tolist() == [-1, 2, 2, 6, 4]
+    assert fill_gaps(station, 'no', 'linear').tolist()[1:] == [2, 4, 6, 4]
+    assert fill_gaps(station, 'no', 'climatology', 0).tolist() == [4, 2, 0, 6, 4]
+    filled = fill_missing_data(store, 0, 'Station', 'no', method='forward', overlay=True)
+    assert filled.column('no').tolist() == [0, 2, 2, 6, 4]
+    assert filled.dates is station.dates
+    assert filled.pollutants == ['no'] and filled.values.shape == (1, 5)
+    assert count_missing_data(store, 'Station', 'no') == 2
+    with pytest.raises(ValueError):
+        fill_gaps(station, 'no', 'mean')
+
+def test_stream_statistics(tmp_path):
+    rows = [['2021-01-01', f'{h:02}:00:00', str(h), 'No data' if h < 3 else '1'] for h in range(1, 25)]
+    rows += [['2021-02-03', '01:00:00', '5', '2']]
+    store = write_station(tmp_path, rows)
+    statistics = stream_statistics(tmp_path / 'Station.csv', 'Station', chunk_size=7)
+    assert statistics.rows == 25
+    assert statistics.days == 34
+    assert statistics.daily_average('no') == daily_average(store, 'Station', 'no')
+    assert np.array_equal(statistics.hourly_average('pm10'), hourly_average(store, 'Station', 'pm10'), equal_nan=True)
+    assert statistics.monthly_average('no') == [12.5, 5]
+    assert statistics.count_missing_data('pm10') == 2
+
+def test_station_cache(tmp_path):
+    write_station(tmp_path, [['2021-01-01', '01:00:00', '1.5', 'No data']])
+    parsed = StationStore.from_files(['Station'], tmp_path, cache_dir=tmp_path / 'cache')['Station']
+    cached = StationStore.from_files(['Station'], tmp_path, cache_dir=tmp_path / 'cache')['Station']
+    assert not cached.values.flags.writeable
+    assert cached.header == parsed.header
+    assert cached.dates.tolist() == parsed.dates.tolist()
+    assert count_missing_data({'Station': cached}, 'Station', 'pm10') == 1
+    with open(tmp_path / 'Station.csv', 'a') as f:
+        f.write('\n2021-01-01,02:00:00,2,3')
+    assert len(StationStore.from_files(['Station'], tmp_path, cache_dir=tmp_path / 'cache')['Station']) == 2
+    assert [len(list(directory.iterdir())) for directory in (tmp_path / 'cache').iterdir()] == [1]
+
+def test_parallel_batch_report(tmp_path):
+    rows = [['2021-01-01', f'{h:02}:00:00', str(h), 'No data'] for h in range(1, 25)]
+    for name in ['A', 'B']:
+        write_station(tmp_path, rows)
+        (tmp_path / 'Station.csv').rename(tmp_path / f'{name}.csv')
+    store = StationStore.from_files(['A', 'B'], tmp_path, cache_dir=tmp_path / 'cache')
+    assert pickle.loads(pickle.dumps(store['A'])).source == store['A'].source
+    assert pickle.loads(pickle.dumps(store['A'].with_values(store['A'].values))).source is None
+    parallel = batch_report(store, ['B', 'A'], processes=2)
+    serial = batch_report(store, ['B', 'A'])
+    assert list(parallel) == ['B', 'A']
+    assert parallel['A']['no']['daily_average'].tolist() == serial['A']['no']['daily_average'].tolist()
+    assert parallel['B']['pm10']['count_missing_data'] == 24
+
+def test_incremental_report(tmp_path):
+    rows = [['2021-01-01', f'{h:02}:00:00', str(h), '1'] for h in range(1, 25)]
+    store = write_station(tmp_path, rows[:5])
+    report = IncrementalReport(store)
+    with open(tmp_path / 'Station.csv', 'a') as f:
+        f.write('\n'.join(','.join(row) for row in rows[5:]) + '\n2021-01-02,01:00:00,No')
+    assert report.refresh() == {'Station': 19}
+    assert report.statistics['Station'].daily_median('no') == [12.5]
+    with open(tmp_path / 'Station.csv', 'a') as f:
+        f.write(' data,7\n')
+    assert report.refresh() == {'Station': 1}
+    assert report.refresh() == {'Station': 0}
+    assert report.statistics['Station'].count_missing_data('no') == 1
+    assert daily_average(store, 'Station', 'no') == report.statistics['Station'].daily_average('no') == [12.5]
+
+def test_quantile_sketch(tmp_path):
+    values = np.random.default_rng(0).lognormal(3, 1, 10000)
+    sketches = [QuantileSketch(0.01) for _ in range(4)]
+    for sketch, part in zip(sketches, np.array_split(values, 4)):
+        sketch.add(part)
+    merged = merge_sketches(sketches)
+    assert merged.count == 10000
+    for q in [50, 90, 99]:
+        assert abs(merged.quantile(q) - np.percentile(values, q)) <= 0.011 * np.percentile(values, q)
+    assert np.isnan(QuantileSketch().quantile(50))
+    rows = [[f'2021-0{m}-01', f'{h:02}:00:00', str(h), 'No data'] for m in [1, 2] for h in range(1, 25)]
+    store = write_station(tmp_path, rows)
+    months = period_percentiles(period_sketches(store, 'Station', 'no', 'month'), [50])
+    assert list(months) == [np.datetime64('2021-01'), np.datetime64('2021-02')]
+    assert abs(months[np.datetime64('2021-01')][0] - 12) <= 0.12
+    assert period_sketches(store, 'Station', 'pm10') == {}
+    statistics = stream_statistics(tmp_path / 'Station.csv', 'Station', chunk_size=7)
+    assert statistics.sketches('no', 'year')[np.datetime64('2021')].count == 48
+    assert abs(statistics.percentiles('no', [100], 'year')[np.datetime64('2021')][0] - 24) <= 0.24
+
+def test_rolling(tmp_path):
+    values = np.array([1, 5, np.nan, 3, 8, 2])
+    assert np.array_equal(rolling_mean(values, 2, 1), [1, 3, 5, 3, 5.5, 5], equal_nan=True)
+    assert np.array_equal(rolling_mean(values, 2), [np.nan, 3, np.nan, np.nan, 5.5, 5], equal_nan=True)
+    assert rolling_max(values, 3).tolist() == [1, 5, 5, 5, 8, 8]
+    assert rolling_min(values, 3).tolist() == [1, 1, 1, 3, 3, 2]
+    assert rolling_exceedances(values, 3, 4).tolist() == [0, 1, 1, 1, 1, 1]
+    assert count_exceedances(values, 4) == 2
+    store = write_station(tmp_path, [['2021-01-01', f'{h:02}:00:00', str(h), '1'] for h in range(1, 25)])
+    assert count_exceedances(store['Station'].values, 20, window=8).tolist() == [1, 0]
+
+def test_utils_buffers():
+    values = np.array([3.0, np.nan, 7.0, 1.0, 7.0])
+    assert maxvalue(values) == 2
+    assert minvalue(values) == 3
+    assert sumvalues(array.array('i', [1, 2, 3])) == 6
+    assert meannvalue(memoryview(array.array('d', [1, 2, 6]))) == 3
+    assert countvalue(np.array([1, 1, 2]), 1) == 2
+    assert maxvalue(np.array([np.nan, 1.0])) == 0
+    with pytest.raises(TypeError):
+        meannvalue(np.array([]))
+
+def test_describevalues():
+    expected = {'count': 3, 'sum': 9, 'mean': 3, 'min': 1, 'max': 6, 'argmin': 1, 'argmax': 2}
+    assert describevalues(['2', 1, 6]) == expected
+    assert describevalues(np.array([2, 1, 6])) == expected
+    with pytest.raises(TypeError):
+        describevalues([1, 'a'])
+    with pytest.raises(TypeError):
+        describevalues([])
+
+def stub_server(responses):
+    # Serves json by path with an ETag, and records the path of every request. A list of responses is served in
+    # turn, with an int for an error status
+    log = []
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            log.append(self.path)
+            response = responses[self.path]
+            if isinstance(response, list):
+                response = response.pop(0) if len(response) > 1 else response[0]
+            if isinstance(response, int):
+                self.send_response(response)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            body = json.dumps(response).encode()
+            etag = f'"{hash(body)}"'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        def log_message(self, *args):
+            pass
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}', log
+
+def test_response_cache(tmp_path):
+    londonair = pytest.importorskip('londonair')
+    today = datetime.date(2024, 6, 10)
+    assert londonair.url_ttl('/Data/StartDate=2021-01-01/EndDate=2022-01-02/Json', today) == londonair.HISTORIC_TTL
+    assert londonair.url_ttl('/Annual/SiteCode=MY1/Year=2024/Json', today) == londonair.LIVE_TTL
+    assert londonair.url_ttl('/Daily/Date=2024-06-08/Json', today) == londonair.RECENT_TTL
+    assert londonair.normalise_url('HTTP://Host//a/b/?y=1&x=2') == 'http://host/a/b?x=2&y=1'
+    url, log = stub_server({'/Data/Year=2020/Json': {'value': 1}})
+    cache = londonair.ResponseCache(tmp_path, max_entries=1)
+    assert londonair.get_json(url + '/Data/Year=2020/Json', cache) == {'value': 1}
+    assert londonair.get_json(url + '//Data/Year=2020/Json/', cache) == {'value': 1}
+    assert londonair.get_json(url + '/Data/Year=2020/Json', londonair.ResponseCache(tmp_path)) == {'value': 1}
+    assert len(log) == 1
+    cache.get(londonair.normalise_url(url + '/Data/Year=2020/Json'))['expires'] = 0
+    assert londonair.get_json(url + '/Data/Year=2020/Json', cache) == {'value': 1}
+    assert londonair.get_json(url + '/Data/Year=2020/Json', cache) == {'value': 1}
+    assert len(log) == 2
+
+def test_async_client():
+    londonair = pytest.importorskip('londonair')
+    urls = londonair.site_species_urls(['A', 'B'], ['NO2'], [('2020-01-01', '2020-02-01')])
+    assert list(urls)[1] == ('B', 'NO2', '2020-01-01', '2020-02-01')
+    paths = {key: londonair.urlsplit(url).path for key, url in urls.items()}
+    url, log = stub_server({paths[('A', 'NO2', '2020-01-01', '2020-02-01')]: [503, {'site': 'A'}],
+                            paths[('B', 'NO2', '2020-01-01', '2020-02-01')]: [404]})
+    urls = {key: url + path for key, path in paths.items()}
+    responses = londonair.fetch_all(urls, concurrency=2, backoff=0, cache=None, return_exceptions=True)
+    assert list(responses) == list(urls)
+    assert responses[('A', 'NO2', '2020-01-01', '2020-02-01')] == {'site': 'A'}
+    assert isinstance(responses[('B', 'NO2', '2020-01-01', '2020-02-01')], londonair.requests.HTTPError)
+    assert len(log) == 3
+    with pytest.raises(londonair.requests.HTTPError):
+        londonair.fetch_all(list(urls.values())[1:], backoff=0, cache=None)
+
+def test_date_chunks():
+    londonair = pytest.importorskip('londonair')
+    chunks = londonair.date_chunks(datetime.date(2020, 11, 15), datetime.date(2021, 2, 1))
+    assert chunks[1] == (datetime.date(2020, 12, 1), datetime.date(2021, 1, 1))
+    assert len(chunks) == 3
+    assert len(londonair.date_chunks(datetime.date(2021, 1, 1), datetime.date(2021, 1, 16), 'week')) == 3
+
+def test_stream_raw_data():
+    londonair = pytest.importorskip('londonair')
+    data = [{'@MeasurementDateGMT': f'2021-01-01 {h:02}:00:00', '@Value': '' if h == 3 else str(h)} for h in range(24)]
+    payload = json.dumps({'RawAQData': {'@SiteCode': 'MY1', 'Data': data}}, indent=1).encode()
+    parser = londonair.RawDataParser()
+    for i in range(0, len(payload), 7):
+        parser.feed(payload[i:i+7])
+    timestamps, values = parser.arrays()
+    assert parser.done and parser.rows == 24
+    assert timestamps[5] == np.datetime64('2021-01-01T05:00')
+    assert np.isnan(values[3]) and values[4] == 4
+    url, log = stub_server({'/Data/Json': {'RawAQData': {'Data': data[0]}}, '/Other/Json': {'RawAQData': {}}})
+    assert londonair.stream_raw_data(url + '/Data/Json')[1].tolist() == [0]
+    with pytest.raises(ValueError):
+        londonair.stream_raw_data(url + '/Other/Json')
+
+def test_snapshot_store(tmp_path, monkeypatch):
+    snapshots = pytest.importorskip('snapshots')
+    store = snapshots.SnapshotStore(tmp_path / 'snapshots')
+    january = {'@SiteCode': 'A', '@SpeciesCode': 'NO2', 'Data': [
+        {'@MeasurementDateGMT': '2021-01-01 00:00:00', '@Value': '2'},
+        {'@MeasurementDateGMT': '2021-01-02 00:00:00', '@Value': ''}]}
+    with open(tmp_path / 'january.json', 'w') as f:
+        json.dump({'data': {'RawAQData': january}, 'expires': 0}, f)
+    assert store.import_json(tmp_path / 'january.json') == 2
+    assert store.missing('A', 'NO2', datetime.date(2021, 1, 15), datetime.date(2021, 2, 2)) == [
+        (datetime.date(2021, 2, 1), datetime.date(2021, 3, 1))]
+    url, log = stub_server({
+        '/Data/SiteSpecies/SiteCode=A/SpeciesCode=NO2/StartDate=2021-02-01/EndDate=2021-03-01/Json':
+            {'RawAQData': {'Data': [{'@MeasurementDateGMT': '2021-02-03 00:00:00', '@Value': '5'},
+                                    {'@MeasurementDateGMT': '2021-03-01 00:00:00', '@Value': '9'}]}}})
+    londonair = pytest.importorskip('londonair')
+    monkeypatch.setattr(londonair, 'API', url)
+    cache = londonair.ResponseCache()
+    timestamps, values = store.load('A', 'NO2', datetime.date(2021, 1, 1), datetime.date(2021, 3, 1), cache=cache)
+    assert cache.get(londonair.normalise_url(url + log[0])) is None
+    assert snapshots.month_means(timestamps, values) == {'2021-01': 2, '2021-02': 5}
+    store.load('A', 'NO2', datetime.date(2021, 1, 1), datetime.date(2021, 3, 1), cache=None)
+    assert len(log) == 1
+    store.write('A', 'NO2', np.array(['2021-01-01T00:00'], dtype='datetime64[m]'), [3])
+    assert store.read('A', 'NO2', datetime.date(2021, 1, 1), datetime.date(2021, 1, 2))[1].tolist() == [3]
+
+def test_site_catalogue():
+    catalogue = pytest.importorskip('catalogue')
+    def site(code, site_type, *indices):
+        species = [{'@SpeciesCode': f'S{i}', '@AirQualityIndex': str(index)} for i, index in enumerate(indices)]
+        return {'@SiteCode': code, '@SiteName': code.lower(), '@SiteType': site_type,
+                'Species': species[0] if len(species) == 1 else species}
+    data = {'DailyAirQualityIndex': {'LocalAuthority': [
+        {'@LocalAuthorityName': 'A', 'Site': site('A1', 'Roadside', 2)},
+        {'@LocalAuthorityName': 'B'},
+        {'@LocalAuthorityName': 'C', 'Site': [site('C1', 'Roadside', 1, 7), site('C2', 'Kerbside', 4)]}]}}
+    sites = catalogue.SiteCatalogue.from_response(data)
+    assert len(sites) == 3 and sites.species == ['S0', 'S1']
+    assert sites.index.tolist() == [[2, -1], [1, 7], [4, -1]]
+    assert sites.authorities.tolist() == ['A', 'C', 'C']
+    assert sites.recommended('Roadside', 6) == ['a1 (A1)']
+    assert sites.recommended(max_index=9) == ['a1 (A1)', 'c1 (C1)', 'c2 (C2)']
+
+def test_refresh_without_trailing_newline(tmp_path):
+    with open(tmp_path / 'Station.csv', 'w') as f:
+        f.write('date,time,no,pm10\n2021-01-01,01:00:00,1.5,2\n2021-01-01,02:00:00,3')
+    store = StationStore.from_files(['Station'], tmp_path)
+    assert len(store['Station']) == 1
+    with open(tmp_path / 'Station.csv', 'a') as f:
+        f.write(',4\n2021-01-01,03:00:00,6.5,1')
+    assert len(store.refresh()['Station']) == 2
+    assert len(store['Station']) == 3
+    assert daily_average(store, 'Station', 'no') == [11 / 3]
+    with open(tmp_path / 'Station.csv', 'a') as f:
+        f.write('\n2021-01-01,04:00:00,')
+    assert len(store.refresh()['Station']) == 0
+    with open(tmp_path / 'Station.csv', 'a') as f:
+        f.write('5,5')
+    assert len(store.refresh()['Station']) == 1
+    assert store['Station'].column('no').tolist() == [1.5, 3, 6.5, 5]
+
+def test_refresh_partly_written_row(tmp_path):
+    with open(tmp_path / 'Station.csv', 'w') as f:
+        f.write('date,time,no,pm10\n2021-01-01,01:00:00,1.5,2\n2021-01-01,02:00:00,3,No')
+    store = StationStore.from_files(['Station'], tmp_path)
+    assert len(store['Station']) == 1
+    assert len(store.refresh()['Station']) == 0
+    with open(tmp_path / 'Station.csv', 'a') as f:
+        f.write(' data')
+    assert len(store.refresh()['Station']) == 1
+    assert store['Station'].missing_mask('pm10').tolist() == [False, True]
+
+def test_refresh_split_value(tmp_path):
+    with open(tmp_path / 'Station.csv', 'w') as f:
+        f.write('date,time,no,pm10\n2021-01-01,01:00:00,1.5,2\n2021-01-01,02:00:00,3,1')
+    store = StationStore.from_files(['Station'], tmp_path, tmp_path / 'cache')
+    report = IncrementalReport(store)
+    assert store['Station'].column('pm10').tolist() == [2, 1]
+    with open(tmp_path / 'Station.csv', 'a') as f:
+        f.write('5\n2021-01-01,03:00:00,4,6')
+    assert report.refresh() == {'Station': 2}
+    assert store['Station'].column('pm10').tolist() == [2, 15, 6]
+    assert report.statistics['Station'].rows == 3
+    assert report.statistics['Station'].daily_average('pm10') == [23 / 3]
+    with open(tmp_path / 'Station.csv', 'a') as f:
+        f.write('\n2021-01-01,04:00:00,5,7')
+    assert report.refresh() == {'Station': 1}
+    assert store['Station'].column('pm10').tolist() == [2, 15, 6, 7]
+    assert report.statistics['Station'].rows == 4
+    assert StationStore.from_files(['Station'], tmp_path, tmp_path / 'cache')['Station'].pending is not None
+
+def test_snapshot_store_offline(tmp_path, monkeypatch):
+    snapshots = pytest.importorskip('snapshots')
+    londonair = pytest.importorskip('londonair')
+    store = snapshots.SnapshotStore(tmp_path / 'snapshots')
+    today = datetime.date.today()
+    month = today.replace(day=1)
+    store.write('A', 'NO2', np.array([np.datetime64(month, 'm')]), [4])
+    monkeypatch.setattr(londonair, 'API', 'http://127.0.0.1:9')
+    end = datetime.date(today.year + 1, 1, 1)
+    assert store.load('A', 'NO2', month, end, retries=0, cache=None)[1].tolist() == [4]
+    next_month = londonair.date_chunks(month, end)[0][1]
+    url, log = stub_server({f'/Data/SiteSpecies/SiteCode=A/SpeciesCode=NO2/StartDate={month}/EndDate={next_month}/Json':
+        {'RawAQData': {'Data': {'@MeasurementDateGMT': f'{month} 01:00:00', '@Value': '6'}}}})
+    monkeypatch.setattr(londonair, 'API', url)
+    cache = londonair.ResponseCache()
+    assert store.load('A', 'NO2', month, end, cache=cache)[1].tolist() == [4, 6]
+    store.load('A', 'NO2', month, end, cache=cache)
+    assert len(log) == 1
+    url, log = stub_server({log[0]: 503})
+    monkeypatch.setattr(londonair, 'API', url)
+    assert store.load('A', 'NO2', month, end, retries=0, cache=None)[1].tolist() == [4, 6]
+    assert len(log) == 1
+
+def test_colour_rules(monkeypatch):
+    pytest.importorskip('matplotlib')
+    import intelligence
+    map = np.random.default_rng(0).integers(0, 256, (20, 30, 3)).astype(np.float32)
+    for colour, high in [('red', (1, 0, 0)), ('cyan', (0, 1, 1))]:
+        expected = [[all(pixel[i] > 100 if high[i] else pixel[i] < 50 for i in range(3)) for pixel in row] for row in map]
+        assert intelligence.colour_mask(map, intelligence.colour_rule(colour)).tolist() == expected
+    pixels = np.array([[[250, 10, 10], [255, 0, 40], [10, 250, 10], [10, 10, 10]]], dtype=np.float32)
+    red_hue = {'space': 'hsv', 'lower': (0.95, 0.5, 0.5), 'upper': (0.05, None, None)}
+    assert intelligence.colour_mask(pixels, red_hue).tolist() == [[True, True, False, False]]
+    rules = [intelligence.colour_rule('red'), red_hue, intelligence.colour_rule('green')]
+    assert intelligence.classify_pixels(pixels, rules).tolist() == [[1, 1, 3, 0]]
+    monkeypatch.setattr(intelligence.mat_plot, 'imread', lambda path: pixels.astype(np.uint8))
+    assert intelligence.read_map('map.jpg').tolist() == pixels.tolist()
+    with pytest.raises(ValueError):
+        intelligence.colour_rule('purple')
+
+def bfs_labels(IMG, connectivity):
+    # Reference labelling in the order of the original breadth-first search
+    MARK = np.zeros(IMG.shape, dtype=int)
+    shifts = [(i, j) for i in (-1, 0, 1) for j in (-1, 0, 1) if (i or j) and (connectivity == 8 or not (i and j))]
+    count = 0
+    for y, x in zip(*np.nonzero(IMG)):
+        if not MARK[y, x]:
+            count += 1
+            MARK[y, x] = count
+            queue = [(y, x)]
+            while queue:
+                y0, x0 = queue.pop(0)
+                for i, j in shifts:
+                    y1, x1 = y0 + i, x0 + j
+                    if 0 <= y1 < IMG.shape[0] and 0 <= x1 < IMG.shape[1] and IMG[y1, x1] and not MARK[y1, x1]:
+                        MARK[y1, x1] = count
+                        queue.append((y1, x1))
+    return MARK
+
+def test_label_components():
+    pytest.importorskip('matplotlib')
+    from intelligence import label_components
+    diagonal = np.array([[1, 0, 0], [0, 1, 0], [1, 0, 1]])
+    assert label_components(diagonal, 8)[0].tolist() == [[1, 0, 0], [0, 1, 0], [1, 0, 1]]
+    assert label_components(diagonal, 4)[0].tolist() == [[1, 0, 0], [0, 2, 0], [3, 0, 4]]
+    IMG = np.array([[0, 1, 1, 0, 1], [1, 0, 0, 0, 1], [1, 1, 0, 1, 1]])
+    MARK, statistics = label_components(IMG)
+    assert MARK.dtype == np.uint8
+    assert statistics.size.tolist() == [5, 4]
+    assert statistics.bbox.tolist() == [[0, 0, 2, 2], [0, 3, 2, 4]]
+    assert np.allclose(statistics.centroid, [[1, 0.8], [1.25, 3.75]])
+    rng = np.random.default_rng(1)
+    for _ in range(20):
+        IMG = (rng.random(tuple(rng.integers(1, 25, 2))) < rng.random()).astype(int)
+        for connectivity in (4, 8):
+            assert np.array_equal(label_components(IMG, connectivity)[0], bfs_labels(IMG, connectivity))
+    dots = np.zeros((40, 40), dtype=int)
+    dots[::2, ::2] = 1
+    MARK, statistics = label_components(dots)
+    assert MARK.dtype == np.uint16 and len(statistics) == 400 and MARK.max() == 400
+    with pytest.raises(ValueError):
+        label_components(IMG, 6)
+
+def test_component_ranking(tmp_path, monkeypatch):
+    pytest.importorskip('matplotlib')
+    from intelligence import (ComponentStatistics, label_components, top_components_mask,
+                              detect_connected_components_sorted)
+    statistics = ComponentStatistics(np.array([3, 5, 3, 1, 5, 3]), None, None)
+    assert statistics.ranked().tolist() == [2, 5, 1, 3, 6, 4]
+    for k in range(0, 8):
+        assert statistics.top(k).tolist() == statistics.ranked()[:k].tolist()
+    IMG = np.array([[1, 0, 1, 1], [0, 0, 0, 0], [1, 1, 1, 0], [0, 0, 0, 1]])
+    MARK, labelled = label_components(IMG)
+    from_labels = ComponentStatistics.from_labels(MARK)
+    assert from_labels.size.tolist() == labelled.size.tolist() == [1, 2, 4]
+    assert from_labels.bbox.tolist() == labelled.bbox.tolist()
+    assert top_components_mask(MARK, [3]).tolist() == (MARK == 3).tolist()
+    monkeypatch.chdir(tmp_path)
+    assert detect_connected_components_sorted(MARK, output=None, image_output=None).tolist() == [3, 2]
+    assert list(tmp_path.iterdir()) == []
+    detect_connected_components_sorted(MARK, image_output=None)
+    assert (tmp_path / 'cc-output-2b.txt').read_text() == (
+        'Connected Component 3, number of pixels = 4\n'
+        'Connected Component 2, number of pixels = 2\n'
+        'Connected Component 1, number of pixels = 1\n'
+        'Total number of connected components = 3')
+
+def test_tiled_components(tmp_path):
+    pytest.importorskip('matplotlib')
+    from intelligence import colour_rule, colour_mask, label_components, open_map, tiled_colour_mask, tiled_components
+    # Red pixels in a random pattern, with components crossing the borders between bands
+    red = np.random.default_rng(0).random((15, 12)) < 0.45
+    red[:, 5] = True
+    map = np.zeros((15, 12, 3), dtype=np.uint8)
+    map[red, 0] = 255
+    np.save(tmp_path / 'map.npy', map)
+    map = open_map(str(tmp_path / 'map.npy'))
+    assert isinstance(map, np.memmap)
+    rule = colour_rule('red')
+    mask = colour_mask(map, rule)
+    assert tiled_colour_mask(map, rule, 2, out=str(tmp_path / 'mask.npy')).tolist() == mask.tolist()
+    for connectivity in (4, 8):
+        MARK, statistics = label_components(mask, connectivity)
+        for tile_rows in (1, 2, 7):
+            tiled, tiled_statistics = tiled_components(map, rule, tile_rows, connectivity)
+            assert tiled.tolist() == MARK.tolist()
+            assert tiled_statistics.size.tolist() == statistics.size.tolist()
+            assert tiled_statistics.bbox.tolist() == statistics.bbox.tolist()
+            assert np.allclose(tiled_statistics.centroid, statistics.centroid)
+
+def test_analyse_maps(tmp_path):
+    mat_plot = pytest.importorskip('matplotlib.pyplot')
+    from intelligence import analyse_maps
+    # Two maps with the same stem, one red square in the first and two cyan squares in the second
+    map = np.zeros((6, 6, 3), dtype=np.uint8)
+    map[1:3, 1:3, 0] = 255
+    np.save(tmp_path / 'a.npy', map)
+    map = np.zeros((6, 6, 3), dtype=np.uint8)
+    map[0:2, 0:2, 1:] = 255
+    map[4:6, 3:6, 1:] = 255
+    mat_plot.imsave(tmp_path / 'a.png', map)
+
+    output = tmp_path / 'output'
+    summary = analyse_maps(str(tmp_path), str(output))
+    for name in ['a.npy', 'a.png']:
+        for colour in ['red', 'cyan']:
+            assert (output / name / colour / 'cc-output-2a.txt').exists()
+            assert (output / name / colour / 'cc-output-2b.txt').exists()
+    expected = [['a.npy', 'red', '4', '1', '4'], ['a.npy', 'cyan', '0', '0', '0'],
+                ['a.png', 'red', '0', '0', '0'], ['a.png', 'cyan', '10', '2', '6']]
+    with open(output / 'summary.csv') as f:
+        assert list(csv.reader(f)) == [['map', 'colour', 'pixels', 'components', 'largest_component']] + expected
+    assert [[str(value) for value in row.values()] for row in summary] == expected
+    # Maps of the same file name in different directories, written by different workers
+    for hour, size in [('01', 1), ('02', 2)]:
+        (tmp_path / 'hours' / hour).mkdir(parents=True)
+        map = np.zeros((4, 4, 3), dtype=np.uint8)
+        map[:size, :size, 0] = 255
+        np.save(tmp_path / 'hours' / hour / 'map.npy', map)
+    summary = analyse_maps(str(tmp_path / 'hours' / '*' / 'map.npy'), str(output), colours=['red'], processes=2)
+    assert [(row['map'], row['pixels']) for row in summary] == [('01/map.npy', 1), ('02/map.npy', 4)]
+    assert (output / '01' / 'map.npy' / 'red' / 'cc-output-2a.txt').read_text() != \
+        (output / '02' / 'map.npy' / 'red' / 'cc-output-2a.txt').read_text()
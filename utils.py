@@ -1,3 +1,47 @@
+import array
+import numbers
+import numpy as np
+
+
+def _as_array(values):
+    """
+    Returns a NumPy view of a 1D numeric NumPy array, array.array or memoryview, without copying it, so that it can
+    be reduced in C. Returns None for any other sequence, which is handled value by value.
+
+    Parameters:
+        values: sequence of values
+    Returns:
+        data (np array): 1D numeric array sharing the buffer of values, or None
+    """
+
+    if isinstance(values, (np.ndarray, array.array, memoryview)):
+        data = np.asarray(values)
+        if data.ndim == 1 and data.dtype.kind in 'biuf':
+            return data
+    return None
+
+
+def _index_of(data, reduce):
+    """
+    Returns the index of the maximum or minimum of a numeric array like maxvalue and minvalue: the first occurrence, 
+    ignoring NaN values unless the first value is NaN.
+
+    Parameters:
+        data (np array): 1D numeric array
+        reduce (function): np.argmax or np.argmin
+    Returns:
+        index (int): index of the value
+    """
+
+    if data.dtype.kind == 'f':
+        nan = np.isnan(data)
+        if nan[0] or nan.all():
+            return 0
+        if nan.any():
+            data = np.where(nan, data[~nan][0], data)
+    return int(reduce(data))
+
+
 def sumvalues(values):
     '''
     Returns the sum of the values in a sequence, raises an exception if non-numerical values are present.
@@ -7,6 +51,10 @@ def sumvalues(values):
     Returns:
         sum (float): sum of all values in list
     '''
+    data = _as_array(values)
+    if data is not None:
+        return float(np.sum(data, dtype=np.float64))
+
     sum = 0
     for value in values:
 
@@ -28,6 +76,10 @@ def maxvalue(values):
         max_index (int): index of maximum value in list
     """    
 
+    data = _as_array(values)
+    if data is not None and len(data):
+        return _index_of(data, np.argmax)
+
     max = values[0]
     max_index = 0
     for i in range(1, len(values)):
@@ -51,6 +103,10 @@ def minvalue(values):
     Returns:
         min_index (int): index of minimum value in list
     """    
+    data = _as_array(values)
+    if data is not None and len(data):
+        return _index_of(data, np.argmin)
+
     min = values[0]
     min_index = 0
     for i in range(1, len(values)):
@@ -92,8 +148,55 @@ def countvalue(values, x):
     Returns:
         sumvalues(values) / len(values): mean value of list
     """    
+    data = _as_array(values)
+    if data is not None and isinstance(x, numbers.Number):
+        return int(np.count_nonzero(data == x))
+
     count = 0
     for value in values:
         if value == x:
             count += 1
     return count
+
+
+def describevalues(values):
+    """
+    Returns the count, sum, mean, minimum and maximum of a sequence and the indices of the minimum and maximum in one
+    pass, raises an exception if non-numerical values are present or the sequence is empty.
+
+    Parameters:
+        values (list): list of values
+    Returns:
+        description (dict): dictionary of 'count', 'sum', 'mean', 'min', 'max', 'argmin' and 'argmax'
+    """    
+
+    data = _as_array(values)
+    if data is not None and len(data) and not (data.dtype.kind == 'f' and np.isnan(data).any()):
+        argmin = int(np.argmin(data))
+        argmax = int(np.argmax(data))
+        sum = float(np.sum(data, dtype=np.float64))
+        return {'count': len(data), 'sum': sum, 'mean': sum / len(data), 'min': float(data[argmin]), 
+                'max': float(data[argmax]), 'argmin': argmin, 'argmax': argmax}
+
+    count = 0
+    sum = 0
+    for i, value in enumerate(values):
+        # Exception if value is not a number
+        try:
+            value = float(value)
+        except:
+            raise TypeError("Numerical values only.")
+
+        if count == 0 or value < minimum:
+            minimum = value
+            argmin = i
+        if count == 0 or value > maximum:
+            maximum = value
+            argmax = i
+        sum += value
+        count += 1
+
+    if count == 0:
+        raise TypeError("Numerical values only.")
+    return {'count': count, 'sum': sum, 'mean': sum / count, 'min': minimum, 'max': maximum, 
+            'argmin': argmin, 'argmax': argmax}